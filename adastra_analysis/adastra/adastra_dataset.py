@@ -1,4 +1,10 @@
+import json
+import os
+
+import pandas as pd
+
 from adastra_analysis.common.dataset import Dataset
+from adastra_analysis.common.util import fingerprint_utils
 
 from adastra_analysis.adastra.util import base_utils
 from adastra_analysis.adastra.util import nlp_utils
@@ -8,6 +14,9 @@ class AdastraDataset(Dataset):
     """
     
     """
+    # Parallelism and caching only change how fast the dataset is built.
+    performance_settings = ('jobs', 'n_process', 'batch_size', 'nlp_cache')
+
     def __init__(
         self,
 
@@ -16,31 +25,240 @@ class AdastraDataset(Dataset):
         adastra_dir,
         main_character,
         use_nlp = False,
+        nlp_where = nlp_utils.NLP_WHERE,
+        script_glob = None,
+        jobs = 1,
+        n_process = 1,
+        batch_size = None,
+        nlp_cache = True,
     ):
         self.name = name
         self.file = file
         self.adastra_dir = adastra_dir
         self.main_character = main_character
         self.use_nlp = use_nlp
+        self.nlp_where = nlp_where
+        self.script_glob = script_glob
+        self.jobs = jobs or 1
+        self.n_process = n_process
+        self.batch_size = batch_size
+        self.nlp_cache = nlp_cache
 
         self.result = None
 
 
-    def build_dataset(self, datasets=None):
+    def get_dependencies(self, names):
+        """
+        The Adastra dataset is built straight from the script files.
+        """
+        return set()
+
+
+    def get_sources(self):
+        """
+        The dataset is rebuilt whenever any of the script files change.
+        """
+        return self.get_script_filepaths()
+
+
+    def get_code_version(self):
+        """
+        Upgrading the line classifier or the NLP pipeline rebuilds the dataset.
+        """
+        settings = self.get_build_settings()
+        return {key: settings[key] for key in ('classifier', 'nlp_model')}
+
+
+    def get_script_filepaths(self):
+        """
+        Use the scripts in the game directory matching `script_glob` if specified.
+        Otherwise, use the predefined list of Adastra scripts.
+        """
+        if self.script_glob:
+            return base_utils.glob_renpy_filepaths(self.adastra_dir, self.script_glob)
+
+        return base_utils.get_renpy_filepaths(self.adastra_dir)
+
+
+    def build_dataset(self, datasets=None, engine=None, force=False):
         print(f"\nBuilding Adastra dataset using script files in `{self.adastra_dir}`...")
-        adastra_dataset = base_utils.build_adastra_data(
-            adastra_directory=self.adastra_dir,
-            main_character=self.main_character
+        renpy_filepaths = self.get_script_filepaths()
+
+        # Only re-parse the scripts that changed since the dataset was last built (all of them if forced).
+        if force:
+            previous_data, previous_scripts = None, {}
+        else:
+            previous_data, previous_scripts = self.load_previous_build()
+        scripts = self.get_script_stats(renpy_filepaths, previous_scripts)
+
+        changed_filepaths = [
+            filepath for filepath in renpy_filepaths
+            if scripts[filepath]['hash'] != previous_scripts.get(filepath, {}).get('hash')
+        ]
+
+        if previous_data is not None:
+            print(f"@ Re-parsing {len(changed_filepaths)} of {len(renpy_filepaths)} script files; the rest are unchanged.")
+
+        adastra_dataset = base_utils.build_adastra_data_from_files(
+            changed_filepaths,
+            main_character=self.main_character,
+            jobs=self.jobs,
         )
         print("@ Adastra dataset complete!")
 
         # Apply optional NLP processing if specified.
-        if self.use_nlp:
+        if self.use_nlp and not adastra_dataset.empty:
             print(
                 "@ Augmenting dataset with NLP... (This process takes about a minute.)"
             )
-            adastra_dataset = nlp_utils.nlp_augment_adastra_data(adastra_dataset)
+            adastra_dataset = nlp_utils.nlp_augment_adastra_data(
+                adastra_dataset,
+                where=self.nlp_where,
+                n_process=self.n_process,
+                batch_size=self.batch_size,
+                cache_path=self.get_nlp_cache_path(),
+            )
             print("@ Dataset augmented!")
 
+        # Splice the new rows in among the unchanged scripts' rows, in script order.
+        if previous_data is not None:
+            adastra_dataset = self.splice_scripts(
+                renpy_filepaths, changed_filepaths, adastra_dataset, previous_data
+            )
+
+        # Record the line count of each script, to verify the saved dataset on the next build.
+        line_counts = adastra_dataset['file'].value_counts().to_dict()
+        for filepath, stats in scripts.items():
+            stats['lines'] = line_counts.get(base_utils.get_script_name(filepath), 0)
+
+        self.write_scripts_manifest(scripts)
+
         self.result = adastra_dataset
         return adastra_dataset
+
+
+    def get_nlp_cache_path(self):
+        """
+        `nlp_cache` can be a path to share the cache between datasets, or False to disable it.
+        By default, the cache sits next to the dataset file.
+        """
+        if not self.nlp_cache:
+            return None
+
+        if self.nlp_cache is True:
+            cache_path = fingerprint_utils.get_manifest_path(self.file, kind='nlp', extension='sqlite')
+        else:
+            cache_path = self.nlp_cache
+
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        return cache_path
+
+
+    ### Incremental re-parsing
+    def get_scripts_manifest_path(self):
+        return fingerprint_utils.get_manifest_path(self.file, kind='scripts')
+
+
+    def get_build_settings(self):
+        """
+        Changing any of these invalidates every previously parsed script.
+        This includes the classifier and NLP pipeline, so upgrading either re-parses everything.
+        """
+        return {
+            'main_character': self.main_character,
+            'use_nlp': bool(self.use_nlp),
+            'nlp_where': self.nlp_where if self.use_nlp else None,
+            'classifier': base_utils.get_classifier_key(self.main_character),
+            'nlp_model': nlp_utils.get_model_key() if self.use_nlp else None,
+        }
+
+
+    def load_previous_build(self):
+        """
+        Load the previously saved dataset and the stats of the scripts it was built from.
+        Returns `(None, {})` if there is none, or if it no longer matches the recorded scripts.
+        """
+        try:
+            with open(self.get_scripts_manifest_path(), 'r') as fp:
+                manifest = json.load(fp)
+
+            if manifest['settings'] != self.get_build_settings():
+                return None, {}
+
+            previous_data = Dataset.load_dataset(self.file)
+            previous_scripts = manifest['scripts']
+
+        except (OSError, ValueError, KeyError):
+            return None, {}
+
+        # Make sure the saved dataset still holds exactly the rows recorded for each script.
+        expected_counts = {
+            base_utils.get_script_name(filepath): stats['lines']
+            for filepath, stats in previous_scripts.items() if stats.get('lines')
+        }
+        if previous_data.empty or previous_data['file'].value_counts().to_dict() != expected_counts:
+            return None, {}
+
+        return previous_data, previous_scripts
+
+
+    @staticmethod
+    def get_script_stats(renpy_filepaths, previous_scripts):
+        """
+        Collect the size, modification time, and content hash of each script.
+        Hashes are reused for scripts whose size and modification time are unchanged.
+        """
+        scripts = {}
+
+        for filepath in renpy_filepaths:
+            stat = os.stat(filepath)
+            stats = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+            previous = previous_scripts.get(filepath, {})
+            if all(previous.get(key) == value for key, value in stats.items()):
+                stats['hash'] = previous.get('hash')
+            else:
+                stats['hash'] = fingerprint_utils.hash_file(filepath)
+
+            scripts[filepath] = stats
+
+        return scripts
+
+
+    @staticmethod
+    def splice_scripts(renpy_filepaths, changed_filepaths, new_data, previous_data):
+        """
+        Combine the rows of re-parsed scripts with the saved rows of unchanged scripts.
+        Scripts that no longer exist are dropped.
+        """
+        new_files = dict(tuple(new_data.groupby('file', sort=False)))
+        previous_files = dict(tuple(previous_data.groupby('file', sort=False)))
+
+        file_datas = []
+        for filepath in renpy_filepaths:
+            name = base_utils.get_script_name(filepath)
+            source = new_files if filepath in changed_filepaths else previous_files
+
+            if name in source:
+                file_datas.append(source[name])
+
+        if not file_datas:
+            return new_data
+
+        return pd.concat(file_datas, ignore_index=True)
+
+
+    def write_scripts_manifest(self, scripts):
+        """
+        Record the scripts this build was made from, next to the dataset file.
+        """
+        manifest = {
+            'settings': self.get_build_settings(),
+            'scripts': scripts,
+        }
+
+        manifest_path = self.get_scripts_manifest_path()
+        os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+
+        with open(manifest_path, 'w') as fp:
+            json.dump(manifest, fp, indent=2)
@@ -1,8 +1,17 @@
+import glob
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
 import re
 
+import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 
 ADASTRA_RENPY_SCRIPT_FILES = [
     'a1s1.rpy', 'a1s2.rpy', 'a1s3.rpy', 'a1s4.rpy',
@@ -12,234 +21,296 @@ ADASTRA_RENPY_SCRIPT_FILES = [
     'end_game1.rpy', 'end_game2.rpy',
 ]
 
+# Final ordering of the columns.
+ADASTRA_COLUMNS = [
+    'file', 'line_idx',
+    'category', 'speaker',
+    'line',
+    'is_renpy', 'is_choice', 'is_read', 'has_speaker', 'is_branch',
+    'raw',
+]
+
+# Script files are read and classified this many lines at a time.
+RENPY_CHUNK_SIZE = 50000
+
+# Bump whenever a change to reading, cleansing, or classifying lines changes the rows produced;
+# scripts parsed under an older version are re-parsed. (Changes to the rules below are picked up on their own.)
+CLASSIFIER_VERSION = 1
+
+
+### Line-classification rules.
+# Dialogue and player choices as one ordered alternation, so `str.extract` classifies a column in a single pass:
+# alias dialogue, named dialogue, unspecified speaker, internal narration, player choice.
+# Alternatives are tried in order, so the first one that matches the whole line wins.
+LINE_REGEX = re.compile(
+    r'^(?:'
+    r'(?P<alias_char>[a-z]+) "(?P<alias_line>.*)"'
+    r'|"(?P<name_char>.*?)" "(?P<name_line>.*)"'
+    r'|"(?P<unspecified_line>".+")"'
+    r'|"(?P<internal_line>.+)"'
+    r'|"(?P<choice_line>.+)":'
+    r')$'
+)
+
+CHOICE_CONDITION_KEYWORDS = [
+    'if ', 'else:'
+]
+
+RENPY_KEYWORDS = [
+    'ease', 'hide',  'jump', 'label', 'menu', 
+    'pause', 'play', 'queue', 'return', 'scene',
+    'scene', 'show', 'stop', 'window', 'with',
+]
+
+
+def _get_characters_map(main_character):
+    """
+    Map speaker aliases used in the scripts to their proper names.
+    """
+    return {
+        'a'  : 'amicus',
+        'm'  : main_character,
+        'unk': '?????',
+        'com': 'computer',
+        'c'  : 'cassius',
+        'ca' : 'cato',
+        'al' : 'alexios',
+        'v'  : 'virginia',
+        'n'  : 'neferu',
+        'mon': 'monitor',
+        'sc' : 'scipio',
+        'me' : 'meera',
+    }
+
+
+def get_classifier_key(main_character):
+    """
+    Identify the rules and code that turn script lines into rows.
+    Previously parsed scripts are only reused under the same key.
+    """
+    classifier = {
+        'version'   : CLASSIFIER_VERSION,
+        'columns'   : ADASTRA_COLUMNS,
+        'line_regex': LINE_REGEX.pattern,
+        'keywords'  : [RENPY_KEYWORDS, CHOICE_CONDITION_KEYWORDS],
+        'characters': _get_characters_map(main_character),
+    }
+
+    classifier = json.dumps(classifier, sort_keys=True)
+    return hashlib.sha256(classifier.encode('utf-8')).hexdigest()
+
 
 def build_adastra_data(
     adastra_directory,
     main_character='Marco',
     renpy_script_files=ADASTRA_RENPY_SCRIPT_FILES,
+    jobs=1,
 ):
     """
     Load the DataFrame from text and complete all transformations.
+    Script files are parsed and classified in `jobs` worker processes, then concatenated once.
     """
+    renpy_filepaths = get_renpy_filepaths(adastra_directory, renpy_script_files)
 
-    # Convert all Renpy script files into a single unioned DataFrame.
-    data = renpy_files_to_dataframe(adastra_directory, renpy_script_files)
-    
-    # JK:: Why did we do this again?
-    data = data.reset_index()
-    
-    # Categorize the text, extract the speaker (if present), and cleanse the line.
-    data[['category', 'speaker', 'line']] = data.apply(
-        lambda x: extract_text_information(x['raw'], main_character=main_character),
-        axis=1,
-        result_type='expand'
-    )
+    return build_adastra_data_from_files(renpy_filepaths, main_character=main_character, jobs=jobs)
 
-    # Add logic flags to allow cleaner filtering later.
-    data[['is_renpy', 'is_choice', 'is_read', 'has_speaker', 'is_branch']] = data.apply(
-        lambda x: add_filter_flags(x['category'], x['raw']),
-        axis=1,
-        result_type='expand'
-    )
-    
-    # Convert character aliases to their actual names.
-    data['speaker'] = data.apply(
-        lambda x: conform_speaker(x['speaker'], main_character=main_character),
-        axis=1
-    )
-    
-    # Final ordering of the columns.
-    final_select = [
-        'file', 'line_idx',
-        'category', 'speaker',
-        'line',
-        'is_renpy', 'is_choice', 'is_read', 'has_speaker', 'is_branch',
-        'raw',
-    ]
-    data = data[final_select]
 
-    return data
+def build_adastra_data_from_files(renpy_filepaths, main_character='Marco', jobs=1):
+    """
+    Build the DataFrame from an explicit list of script files.
+    """
+    batches = _parse_renpy_batches(renpy_filepaths, main_character=main_character, jobs=jobs)
+
+    if not batches:
+        return pd.DataFrame(columns=ADASTRA_COLUMNS)
+
+    return pd.concat(batches, ignore_index=True)
+
+
+def _parse_renpy_batches(renpy_filepaths, main_character, jobs=1):
+    """
+    Parse and classify each script file, returning the per-file batches in file order.
+    Files are spread across a pool of worker processes if `jobs > 1`.
+    """
+    parse = partial(_parse_renpy_file, main_character=main_character)
+
+    # Spawned rather than forked, so workers never inherit locks held by other threads (e.g. the scheduler's).
+    if jobs > 1 and len(renpy_filepaths) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(renpy_filepaths)), mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            file_batches = list(executor.map(parse, renpy_filepaths))
+    else:
+        file_batches = list(map(parse, renpy_filepaths))
+
+    return [batch for batches in file_batches for batch in batches]
+
+
+def _parse_renpy_file(filepath, main_character, chunk_size=RENPY_CHUNK_SIZE):
+    """
+    Stream a .rpy script in chunks, classifying each chunk into the final columns.
+    """
+    batches = []
+
+    for chunk in _iter_renpy_file_chunks(filepath, chunk_size=chunk_size):
+        classified = classify_renpy_lines(chunk['raw'], main_character=main_character)
+        batches.append(
+            pd.concat([chunk, classified], axis=1)[ADASTRA_COLUMNS]
+        )
+
+    return batches
 
 
 
 ###### FUNCTIONS FOR RAW DATA LOADING
-def _renpy_file_to_dataframe(filepath):
+def _iter_renpy_file_chunks(filepath, chunk_size=RENPY_CHUNK_SIZE):
     """
-    Read a .rpy script and collect row information for each line.
+    Stream a .rpy script as columnar chunks of `file`, `line_idx`, and `raw`.
     """
-    columns = ['file', 'line_idx', 'raw']
+    file_name = get_script_name(filepath)
 
-    file_name = os.path.splitext(
-        os.path.basename(filepath)
-    )[0]
-    
     with open(filepath, 'r') as fp:
-        raw_line = fp.readlines()
-        
-    rows = []
-    for line_idx, line in enumerate(raw_line):
-        rows.append( [file_name, line_idx, line] )
+        line_idx = 0
 
-    return pd.DataFrame(rows, columns=columns)
+        while True:
+            raw_lines = list(itertools.islice(fp, chunk_size))
+            if not raw_lines:
+                break
 
+            yield pd.DataFrame({
+                'file': file_name,
+                'line_idx': np.arange(line_idx, line_idx + len(raw_lines), dtype=np.int64),
+                'raw': raw_lines,
+            })
 
-def renpy_files_to_dataframe(adastra_directory, renpy_filenames):
+            line_idx += len(raw_lines)
+
+
+def get_renpy_filepaths(adastra_directory, renpy_filenames=ADASTRA_RENPY_SCRIPT_FILES):
     """
-    Given a directory of renpy scripts, return as a single Pandas DF.
-    Collect the filename, line number, and raw text of each line.
+    Build the full paths to the Renpy script files.
     """
-    
-    file_dataframes = []
-    for file in renpy_filenames:
+    return [
+        os.path.join(adastra_directory, 'game', file)
+        for file in renpy_filenames
+    ]
 
-        # Build the full path to the Renpy script file.
-        renpy_filepath = os.path.join(
-            adastra_directory, 'game', file
-        )
 
-        dataframe = _renpy_file_to_dataframe(renpy_filepath)
-        file_dataframes.append(dataframe)
-        
-    return pd.concat(file_dataframes)
+def glob_renpy_filepaths(adastra_directory, script_glob):
+    """
+    Discover the Renpy script files in the game directory that match the glob (e.g. `*.rpy`).
+    """
+    return sorted(glob.glob(
+        os.path.join(adastra_directory, 'game', script_glob), recursive=True
+    ))
+
 
+def get_script_name(filepath):
+    """
+    Scripts are identified by their file name without extension (the `file` column).
+    """
+    return os.path.splitext(
+        os.path.basename(filepath)
+    )[0]
 
 
-######### FUNCTIONS FOR CLEANING
-def _cleanse_line(line, main_character):
+
+######### FUNCTIONS FOR VECTORIZED CLASSIFICATION
+def _cleanse_lines(lines, main_character):
     """
-    Cleanse the extracted lines to remove formatting.
+    Cleanse a column of lines to remove formatting.
     """
-    # Strip the line, just in case.
-    line = line.strip()
-    
-    # Clean up formatting characters.
-    line = line.replace('\\'  , '')  # Remove escape characters.
-    line = line.replace('[mc]', main_character)  # Standardize MC name.
-    line = re.sub(r'{/?i}'    , '*', line)  # Convert italics to Markdown.
-    line = re.sub(r'{cps=\d+}', '' , line)  # Remove scroll speed formatting.
-    
-    return line
+    lines = lines.str.strip()
+
+    lines = lines.str.replace('\\'  , '', regex=False)  # Remove escape characters.
+    lines = lines.str.replace('[mc]', main_character, regex=False)  # Standardize MC name.
+    lines = lines.str.replace(r'{/?i}'    , '*', regex=True)  # Convert italics to Markdown.
+    lines = lines.str.replace(r'{cps=\d+}', '' , regex=True)  # Remove scroll speed formatting.
+
+    return lines
 
-def extract_text_information(text, main_character):
+
+def _startswith_any(lines, prefixes):
     """
-    Categorize each line based on rules involving special characters, keywords, and regex matches.
-    Extract relevant metadata and clean the lines as needed.
+    Vectorized `any(line.startswith(x) for x in prefixes)`.
     """
+    return lines.str.match('|'.join(map(re.escape, prefixes)))
+
 
-    DIALOGUE_ALIAS_REGEX       = re.compile(r'^(?P<char>[a-z]+) "(?P<line>.*)"$')
-    DIALOGUE_NAME_REGEX        = re.compile(r'^"(?P<char>.*?)" "(?P<line>.*)"$')
-    DIALOGUE_UNSPECIFIED_REGEX = re.compile(r'^"(?P<line>".+")"$')
-    DIALOGUE_INTERNAL_REGEX    = re.compile(r'^"(?P<line>.+)"$')
-    CHOICE_PLAYER_REGEX        = re.compile(r'^"(?P<line>.+)":$')
+def classify_renpy_lines(raw, main_character):
+    """
+    Categorize a whole column of raw script lines at once, based on special characters, keywords, and regex matches.
+    Extract the speaker and cleaned text of each line, and add flags for easier filtering downstream.
 
-    CHOICE_CONDITION_KEYWORDS = [
-        'if ', 'else:'
+    Returns a DataFrame aligned to `raw` with columns:
+    category, speaker, line, is_renpy, is_choice, is_read, has_speaker, is_branch
+    """
+    text = _cleanse_lines(raw, main_character=main_character)
+
+    # Some categories are obvious.
+    prefix_conditions = [
+        text.str.startswith('#'),
+        text.str.startswith('$'),
+        _startswith_any(text, RENPY_KEYWORDS) | (text == ''),
+        _startswith_any(text, CHOICE_CONDITION_KEYWORDS),
     ]
+    prefix_categories = ['renpy_comment', 'renpy_python', 'renpy_keyword', 'choice_condition']
+
+    # Others need regex to pull out the necessary pieces (only for lines without an obvious category).
+    is_regex = ~np.logical_or.reduce(prefix_conditions)
+    matches = text.str.extract(LINE_REGEX)
 
-    RENPY_KEYWORDS = [
-        'ease', 'hide',  'jump', 'label', 'menu', 
-        'pause', 'play', 'queue', 'return', 'scene',
-        'scene', 'show', 'stop', 'window', 'with',
+    regex_conditions = [
+        is_regex & matches[group].notna()
+        for group in ('alias_line', 'name_line', 'unspecified_line', 'internal_line', 'choice_line')
+    ]
+    regex_categories = [
+        'dialogue_alias', 'dialogue_name', 'dialogue_unspecified', 'dialogue_internal', 'choice_player'
     ]
 
+    category = np.select(
+        prefix_conditions + regex_conditions,
+        prefix_categories + regex_categories,
+        default='unknown'
+    ).astype(object)
 
-    ### Standardize formatting to make the extraction process easier.
-    text = _cleanse_line(text, main_character=main_character)
-    
-    ### Create categories and isolate speaker for each line.
-    category = 'unknown'
-    speaker = None
-    line = text
-    
-    # Some categories are obvious.
-    if text.startswith('#'):
-        category = 'renpy_comment'
-    elif text.startswith("$"):
-        category = 'renpy_python'
-    elif any(text.startswith(x) for x in RENPY_KEYWORDS) or text == '':
-        category = 'renpy_keyword'
-    elif any(text.startswith(x) for x in CHOICE_CONDITION_KEYWORDS):
-        category = 'choice_condition'
-    
-    # Others need regex to pull out the necessary pieces.
-    else:
-        is_dialogue_alias_match       = DIALOGUE_ALIAS_REGEX.match(text)
-        is_dialogue_name_match        = DIALOGUE_NAME_REGEX.match(text)
-        is_dialogue_unspecified_match = DIALOGUE_UNSPECIFIED_REGEX.match(text)
-        is_dialogue_internal_match    = DIALOGUE_INTERNAL_REGEX.match(text)
-        is_choice_player_match        = CHOICE_PLAYER_REGEX.match(text)
-        
-        # Test each regex, and if True, extract relevant fields.
-        if is_dialogue_alias_match:
-            speaker  = is_dialogue_alias_match.group('char')
-            line     = is_dialogue_alias_match.group('line')
-            category = 'dialogue_alias'
-        elif is_dialogue_name_match:
-            speaker  = is_dialogue_name_match.group('char')
-            line     = is_dialogue_name_match.group('line')
-            category = 'dialogue_name'
-        elif is_dialogue_unspecified_match:
-            speaker  = 'speaker_unspecified'
-            line     = is_dialogue_unspecified_match.group('line')
-            category = 'dialogue_unspecified'
-        elif is_dialogue_internal_match:
-            speaker  = 'internal_narration'
-            line     = is_dialogue_internal_match.group('line')
-            category = 'dialogue_internal'
-        elif is_choice_player_match:
-            line     = is_choice_player_match.group('line')
-            category = 'choice_player'
-    
-    return (category, speaker, line)
-
-
-def add_filter_flags(category, text):
-    """
-    Add flag columns for easier filtering downstream.
-    """    
-    # Specify if a line is internal to Renpy.
-    is_renpy = category.startswith('renpy_')
-    
-    # Specify which lines indicate a crossroads.
-    is_choice = category.startswith('choice_')
-
-    # Specify when it's actual text to be read.
-    is_read = category.startswith('dialogue_')
-    
-    # Specify when a character actually speaks the line.
-    has_speaker = is_read and category not in ('dialogue_unspecified', 'dialogue_internal')
-    
-    # Optional (branching) content is tab-indented.
-        # Note: This is custom to Adastra, not all RenPy games!
-        # * conditional   = 0 space indent; branch content = 4 space indent
-        # * player_choice = 4 space indent; branch content = 8 space indent
-    is_branch = text.startswith(' ' * 4) and not is_choice
-    
-    return (is_renpy, is_choice, is_read, has_speaker, is_branch)
+    speaker = np.select(
+        regex_conditions[:4],
+        [matches['alias_char'], matches['name_char'], 'speaker_unspecified', 'internal_narration'],
+        default=None
+    )
 
+    line = np.select(
+        regex_conditions,
+        [matches[group] for group in ('alias_line', 'name_line', 'unspecified_line', 'internal_line', 'choice_line')],
+        default=text
+    )
 
-def conform_speaker(speaker, main_character):
-    """
-    Normalize speaker names using the predefined map.
-    """
+    classified = pd.DataFrame({
+        'category': category,
+        'speaker' : speaker,
+        'line'    : line,
+    }, index=raw.index)
 
-    CHARACTERS_MAP = {
-        'a'  : 'amicus',
-        'm'  : main_character,
-        'unk': '?????',
-        'com': 'computer',
-        'c'  : 'cassius',
-        'ca' : 'cato',
-        'al' : 'alexios',
-        'v'  : 'virginia',
-        'n'  : 'neferu',
-        'mon': 'monitor',
-        'sc' : 'scipio',
-        'me' : 'meera',
-    }
+    # Convert character aliases to their actual names.
+    has_speaker_alias = classified['speaker'].notna()
+    speakers = classified.loc[has_speaker_alias, 'speaker']
+
+    classified.loc[has_speaker_alias, 'speaker'] = (
+        speakers.map(_get_characters_map(main_character)).fillna(speakers).str.lower()
+    )
 
-    # Join the speaker aliases to their proper name.
-    if speaker is None:
-        return None
+    # Add logic flags to allow cleaner filtering later.
+    # Lines internal to Renpy, crossroads, text to be read, and lines a character actually speaks.
+    classified['is_renpy'] = classified['category'].str.startswith('renpy_')
+    classified['is_choice'] = classified['category'].str.startswith('choice_')
+    classified['is_read'] = classified['category'].str.startswith('dialogue_')
+    classified['has_speaker'] = classified['is_read'] & ~classified['category'].isin(['dialogue_unspecified', 'dialogue_internal'])
+
+    # Optional (branching) content is tab-indented.
+        # Note: This is custom to Adastra, not all RenPy games!
+        # * conditional   = 0 space indent; branch content = 4 space indent
+        # * player_choice = 4 space indent; branch content = 8 space indent
+    classified['is_branch'] = raw.str.startswith(' ' * 4) & ~classified['is_choice']
 
-    return CHARACTERS_MAP.get(speaker, speaker).lower() 
+    return classified
@@ -1,92 +1,239 @@
+import hashlib
+import json
+import sqlite3
+
 import numpy as np
 import pandas as pd
 
-import spacy
-from spacytextblob.spacytextblob import SpacyTextBlob
+from importlib import metadata
+
+# spaCy and spacytextblob (with NLTK) take seconds to import, so they are only imported once NLP is applied.
+
+from adastra_analysis.common.dataset import Dataset
+
+
+# Columns added to the dataset, in order.
+NLP_COLUMNS = [
+    'sentiment', 'subjectivity',
+    'sentences', 'num_sentences',
+    'words', 'num_words',
+    'content_words', 'num_content_words',
+]
 
+# SQLite types of the NLP columns, for the on-disk cache.
+NLP_COLUMN_TYPES = {
+    'sentiment': 'REAL', 'subjectivity': 'REAL',
+    'sentences': 'TEXT', 'num_sentences': 'INTEGER',
+    'words': 'TEXT', 'num_words': 'INTEGER',
+    'content_words': 'TEXT', 'num_content_words': 'INTEGER',
+}
 
-def nlp_augment_adastra_data(adastra_data):
+NLP_MODEL = 'en_core_web_sm'
+
+# Components of `en_core_web_sm` that none of the NLP columns use.
+# (Sentences come from the parser; stop-words and punctuation are lexical attributes.)
+UNUSED_PIPES = ['tagger', 'attribute_ruler', 'lemmatizer', 'ner']
+
+
+def load_nlp():
     """
-    Apply NLP on the lines to add sentiment, tokenization, etc.
+    Build the spacy language model with only the components needed, and add the sentiment pipe.
     """
+    import spacy
+    from spacytextblob.spacytextblob import SpacyTextBlob  # Registers the `spacytextblob` pipe.
 
-    # Define the characters used to join lists into single strings for output.
-    sentence_join_str = '\n'
-    word_join_str     = ' '
-
-    # Build the spacy language model, and add the sentiment pipe.
-    nlp = spacy.load('en_core_web_sm')
+    nlp = spacy.load(NLP_MODEL, exclude=UNUSED_PIPES)
     nlp.add_pipe('spacytextblob')
+    return nlp
 
+
+def _extract_doc_features(doc, sentence_join_str='\n', word_join_str=' '):
+    """
+    Collect every NLP column of a single doc in one pass over its tokens.
+    """
+    # Isolate sentences
+    sentences = [sent.text for sent in doc.sents]
+
+    # Extract lists of actual words, and the non-stop words among them.
+    words = []
+    content_words = []
+
+    for token in doc:
+        if token.is_punct:
+            continue
+
+        words.append(token.orth_)
+
+        if not token.is_stop:
+            content_words.append(token.orth_.lower())
+
+    return (
+        # Add sentiment (polarity) and subjectivity, from `spacytextblob`.
+        doc._.polarity, doc._.subjectivity,
+        sentence_join_str.join(sentences), len(sentences),
+        word_join_str.join(words), len(words),
+        word_join_str.join(content_words), len(content_words),
+    )
+
+
+# Only dialogue and choices are read by the player; the rest of the script is code, comments, and blank lines.
+NLP_WHERE = 'is_read or is_choice'
+
+
+def nlp_augment_adastra_data(adastra_data, where=NLP_WHERE, n_process=1, batch_size=None, cache_path=None):
+    """
+    Apply NLP on the lines to add sentiment, tokenization, etc.
+
+    Only rows matching the `where` clause are processed (all rows if None); the NLP columns of the rest are null.
+    `n_process` and `batch_size` are passed to `nlp.pipe`; use `n_process > 1` to spread the model across cores.
+    Each distinct line is only processed once. If `cache_path` is specified, results are cached there by line,
+    and only lines unseen by this model and pipeline are sent through it.
+    """
     # Copy the DF to prevent in-place transformations.
     data = adastra_data.copy()
-    
-    # Pipe the lines through the spaCy document-creator.
-    docs = list(
-        nlp.pipe( data['line'] )
-    )
-    
-    
-    # Build up the new columns' values as lists.
-
-    # Add sentiment (polarity) and subjectivity, from `spacytextblob`.
-    sentiment_list = list(map(
-        lambda doc: doc._.polarity,
-        docs
-    ))
-    
-    subjectivity_list = list(map(
-        lambda doc: doc._.subjectivity,
-        docs
-    ))
-    
-    # Isolate sentences
-    sentences_list = list(map(
-        lambda doc: [sent.text for sent in doc.sents],
-        docs
-    ))
-    num_sentences_list = list(map(len, sentences_list))
-    sentences_list = list(map(
-        lambda sents: sentence_join_str.join(sents),
-        sentences_list
-    ))
-    
-    # Extract lists of actual words
-    words_list = list(map(
-        lambda doc: [token.orth_ for token in doc
-            if not token.is_punct],
-        docs
-    ))
-    num_words_list = list(map(len, words_list))
-    words_list = list(map(
-        lambda words: word_join_str.join(words),
-        words_list
-    ))
-
-    # Extract non-stop words
-    content_words_list = list(map(
-        lambda doc: [token.orth_.lower() for token in doc
-            if not token.is_stop and not token.is_punct],
-        docs
-    ))
-    num_content_words_list = list(map(len, content_words_list))
-    content_words_list = list(map(
-        lambda words: word_join_str.join(words),
-        content_words_list
-    ))
-
-    
-    # Save the new NLP information as columns.
-    data['sentiment']          = sentiment_list
-    data['subjectivity']       = subjectivity_list
-    
-    data['sentences']          = sentences_list
-    data['num_sentences']      = num_sentences_list
-    
-    data['words']              = words_list
-    data['num_words']          = num_words_list
-    
-    data['content_words']     = content_words_list
-    data['num_content_words'] = num_content_words_list
-    
+
+    if where:
+        mask = Dataset.where_mask(data, where)
+    else:
+        mask = pd.Series(True, index=data.index)
+
+    lines = pd.unique(data.loc[mask, 'line'])
+
+    if cache_path is None:
+        features = _process_lines(lines, n_process=n_process, batch_size=batch_size)
+
+    else:
+        conn = sqlite3.connect(cache_path)
+
+        try:
+            with conn:
+                model_key = get_model_key()
+                _create_cache_table(conn)
+
+                cached = _read_cached_features(conn, model_key, lines)
+                unseen = [line for line in lines if line not in cached.index]
+
+                print(f"@ {len(lines) - len(unseen)} of {len(lines)} distinct lines found in the NLP cache.")
+
+                processed = _process_lines(unseen, n_process=n_process, batch_size=batch_size)
+                _write_cached_features(conn, model_key, processed)
+
+        finally:
+            conn.close()
+
+        # (Empty frames are left out so they don't turn the numeric columns into objects.)
+        frames = [frame for frame in (cached, processed) if not frame.empty]
+        features = pd.concat(frames) if frames else processed
+
+    # Save the new NLP information as columns, copied to every row sharing a line.
+    # Rows outside of the mask are left null; counts stay integers (nullable) instead of turning into floats.
+    features = features.loc[data.loc[mask, 'line']]
+
+    for column in NLP_COLUMNS:
+        data[column] = pd.Series(features[column].values, index=data.index[mask])
+
+        if NLP_COLUMN_TYPES[column] == 'INTEGER':
+            data[column] = data[column].astype('Int64')
+
     return data
+
+
+def _process_lines(lines, n_process=1, batch_size=None):
+    """
+    Pipe distinct lines through the spaCy document-creator, returning their NLP columns indexed by line.
+    """
+    if len(lines) == 0:
+        return pd.DataFrame(columns=NLP_COLUMNS, index=pd.Index([], name='line'))
+
+    nlp = load_nlp()
+
+    # Docs are consumed as they stream out, so they never need to be held in memory together.
+    # Sentiment is added as each doc arrives, since the TextBlob attributes cannot be sent between processes.
+    sentiment = nlp.get_pipe('spacytextblob')
+    docs = nlp.pipe(
+        lines, n_process=n_process, batch_size=batch_size, disable=['spacytextblob']
+    )
+
+    return pd.DataFrame(
+        [_extract_doc_features(sentiment(doc)) for doc in docs],
+        columns=NLP_COLUMNS,
+        index=pd.Index(lines, name='line'),
+    )
+
+
+
+###### FUNCTIONS FOR THE NLP CACHE
+def get_model_key():
+    """
+    Identify the model and pipeline that produce the NLP columns.
+    Cached results are only reused under the same key.
+    Versions are read from the installed packages' metadata, so spaCy is not imported just to check a build is up to date.
+    """
+    pipeline = {
+        'model'        : NLP_MODEL,
+        'model_version': _get_package_version(NLP_MODEL),
+        'spacy'        : _get_package_version('spacy'),
+        'spacytextblob': _get_package_version('spacytextblob'),
+        'exclude'      : UNUSED_PIPES,
+        'columns'      : NLP_COLUMN_TYPES,
+    }
+
+    pipeline = json.dumps(pipeline, sort_keys=True)
+    return hashlib.sha256(pipeline.encode('utf-8')).hexdigest()
+
+
+def _get_package_version(name):
+    """
+    The installed version of a package, or None if it is not installed.
+    """
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _create_cache_table(conn):
+    columns = ', '.join(f"{column} {dtype}" for column, dtype in NLP_COLUMN_TYPES.items())
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS nlp_cache (
+            model TEXT NOT NULL,
+            line TEXT NOT NULL,
+            {columns},
+            PRIMARY KEY (model, line)
+        )
+    """)
+
+
+def _read_cached_features(conn, model_key, lines):
+    """
+    Look up the cached NLP columns of the lines, indexed by line. Lines missing from the cache are left out.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (line TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM lookup")
+    conn.executemany("INSERT INTO lookup VALUES (?)", ((line,) for line in lines))
+
+    cached = pd.read_sql_query(
+        f"""
+            SELECT nlp_cache.line, {', '.join(NLP_COLUMNS)}
+            FROM nlp_cache
+            JOIN lookup ON nlp_cache.line = lookup.line
+            WHERE nlp_cache.model = ?
+        """,
+        conn, params=(model_key,), index_col='line',
+    )
+
+    conn.execute("DROP TABLE lookup")
+    return cached
+
+
+def _write_cached_features(conn, model_key, features):
+    placeholders = ', '.join('?' for _ in range(len(NLP_COLUMNS) + 2))
+
+    conn.executemany(
+        f"INSERT OR REPLACE INTO nlp_cache (model, line, {', '.join(NLP_COLUMNS)}) VALUES ({placeholders})",
+        (
+            (model_key, line, *values)
+            for line, values in zip(features.index, features.itertuples(index=False))
+        )
+    )
@@ -12,6 +12,8 @@ def run():
     # Build subprocess
     build = subparser.add_parser('build')
     build.add_argument('-d', '--datasets', required=False, type=str, nargs='*')
+    build.add_argument('-j', '--jobs'    , required=False, type=int, default=1)
+    build.add_argument('-f', '--force'   , required=False, action='store_true')
     
     # Run subprocess
     run = subparser.add_parser('run')
@@ -19,6 +21,8 @@ def run():
     run.add_argument('-s', '--screenplays', required=False, type=str, nargs='*')
     run.add_argument('-r', '--relplots'   , required=False, type=str, nargs='*')
     run.add_argument('-w', '--wordclouds' , required=False, type=str, nargs='*')
+    run.add_argument('-j', '--jobs'       , required=False, type=int, default=1)
+    run.add_argument('-f', '--force'      , required=False, action='store_true')
 
     # A custom configs path can be supplied.
     # Otherwise, it defaults to a library-internal one.
@@ -34,10 +38,9 @@ def run():
 
     # Rebuild the datasets if specified.
     if args.command == 'build':
-        aa.build_datasets(args.datasets)
+        aa.build_datasets(args.datasets, jobs=args.jobs, force=args.force)
 
     elif args.command == 'run':
-        aa.load_datasets()
 
         ###
         # Set the run options.
@@ -59,24 +62,7 @@ def run():
             runs = {key: [] for key in runs}
 
 
-        ###  
-        # Retrieve the datasets and complete each run.
-        ### 
-
-        # Retrieve the runs from the arguments.
-        run_lambdas = {
-            'queries'    : aa.run_queries,
-            'relplots'   : aa.run_relplots,
-            'screenplays': aa.run_screenplays,
-            'wordclouds' : aa.run_wordclouds,
-        }
-
-        for run_type, run_args in runs.items():
-
-            # Ignore undefined runs.
-            # (Runs are redefined as [] if all None.)
-            if run_args is None:
-                continue
-
-            # Apply the specified lambda using the provided arguments.
-            run_lambdas[run_type](run_args)
+        ###
+        # Load the datasets and complete each run as soon as the datasets it uses are ready.
+        ###
+        aa.run(runs, jobs=args.jobs, force=args.force)
@@ -1,14 +1,38 @@
+import importlib
+import multiprocessing
 import sys
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from adastra_analysis.common.dataset import Dataset
+from adastra_analysis.common.query_engine import get_engine_backend, get_query_engine
+from adastra_analysis.common.scheduler import Scheduler
+from adastra_analysis.common.util import fingerprint_utils
 from adastra_analysis.common.util import yaml_utils
 
 
 class AdastraAnalysis:
-    
+
+    # Run types in the order they are scheduled, with their display names.
+    RUN_TYPES = {
+        'queries'    : 'Query',
+        'relplots'   : 'Relplot',
+        'screenplays': 'Screenplay',
+        'wordclouds' : 'Wordcloud',
+    }
+
+    # Run types whose outputs are rendered in worker processes with `--jobs`, by module-level render functions.
+    # Given as (module, function), so the render helpers are only imported once a render is submitted.
+    RENDERERS = {
+        'relplots'   : ('adastra_analysis.runs.util.relplot_utils'  , 'render_relplot'  ),
+        'wordclouds' : ('adastra_analysis.runs.util.wordcloud_utils', 'render_wordcloud'),
+    }
+
 
     def __init__(self, configs_filepath):
-        
+
         self.yaml_configs = yaml_utils.load_yaml(configs_filepath)
 
         self.dataset_configs    = self.yaml_configs.get('datasets'   , {}).get('datasets')
@@ -17,169 +41,348 @@ class AdastraAnalysis:
         self.screenplay_configs = self.yaml_configs.get('screenplays', {}).get('screenplays')
         self.wordcloud_configs  = self.yaml_configs.get('wordclouds' , {}).get('wordclouds')
 
+        self.run_configs = {
+            'queries'    : self.query_configs,
+            'relplots'   : self.relplot_configs,
+            'screenplays': self.screenplay_configs,
+            'wordclouds' : self.wordcloud_configs,
+        }
+
         self.datasets = {}
+        self.fingerprints = {}  # Dataset name to the fingerprint of its file.
+        self.columns = {}       # Dataset name to the columns runs read from it (missing for all columns).
+        self.references = {}    # Dataset name to the number of scheduled steps that still read from it.
+        self.lock = threading.Lock()
+
+        # A single query engine answers every `sql` block, so datasets are only registered once.
+        # The backend is selected by the top-level `query_engine` key (default: `sqlite`).
+        # Up to `query_cache_size` results are memoized for runs that repeat the same SQL.
+        self.engine = get_query_engine(
+            self.yaml_configs.get('query_engine', 'sqlite'),
+            cache_size=self.yaml_configs.get('query_cache_size', 128),
+        )
+
+        # Worker processes for rendering wordclouds (only used with `jobs > 1`).
+        self.executor = None
+        self.render_slots = None
 
+        # Regenerate every output, even those whose fingerprints are unchanged.
+        self.force = False
 
 
-    def build_datasets(self, datasets):
+
+    def get_fingerprint(self, config, dependencies):
         """
-        
+        Fingerprint a dataset or run from its config, its upstream datasets, its source files, and its code version.
+        Upstream datasets are read through the query engine, so switching backends (or upgrading one) regenerates them.
         """
-        print("\nBuilding datasets for run...")
+        return fingerprint_utils.build_fingerprint(
+            config,
+            upstream={name: self.get_dataset_fingerprint(name) for name in sorted(dependencies)},
+            sources=config.get_sources(),
+            version=config.get_code_version(),
+            engine=get_engine_backend(self.engine) if dependencies else None,
+        )
 
-        # Retrieve the queries configs to process from the Configs.
-        if self.dataset_configs is None:
-            print("@ No datasets found!")
-            return
 
-        # Iterate and build each query.
-        for config in self.dataset_configs:
-            name = config.name
-            file = config.file
+    def get_dataset_fingerprint(self, name):
+        """
+        Datasets built in this session record their fingerprints; otherwise, read it from the file on disk.
+        """
+        if name not in self.fingerprints:
+            file = next(config.file for config in self.dataset_configs if config.name == name)
+            self.fingerprints[name] = fingerprint_utils.get_output_fingerprint(file)
 
-            # Process selected queries if specified. Otherwise, run all.
-            if datasets and name not in datasets:
+        return self.fingerprints[name]
 
-                # Still load the dataset so it can be used in other datasets.
-                _dataset = Dataset.load_dataset(file)
 
-            else:
-                _dataset = config.build_dataset(self.datasets)
-                Dataset.save(_dataset, file, info=True)
 
-            self.datasets[name] = _dataset
+    def register_dataset(self, name, dataset):
+        """
+        Hand a newly built or loaded dataset to the query engine (if one is in use).
+        """
+        self.datasets[name] = dataset
 
+        if self.engine is not None:
+            self.engine.register(name, dataset)
 
 
-    def load_datasets(self):
+    def retain_datasets(self, names):
         """
-        
+        Mark the datasets as needed by one more scheduled step.
         """
-        print("\nLoading datasets for run...")
+        with self.lock:
+            for name in names:
+                self.references[name] = self.references.get(name, 0) + 1
 
-        for config in self.dataset_configs:
 
-            try:
-                name = config.name
-                file = config.file
+    def release_datasets(self, names):
+        """
+        Mark a step as done with the datasets, dropping any that nothing left to run reads from.
+        """
+        with self.lock:
+            for name in names:
+                self.references[name] -= 1
+
+                if self.references[name] > 0:
+                    continue
 
-                _dataset = config.load_dataset(file)
-                self.datasets[name] = _dataset
-                print(f"* Dataset `{name}` loaded: `{file}`")
+                del self.references[name]
+                self.datasets.pop(name, None)
 
-            except Exception as err:
-                print(
-                    f"! Dataset `{name}` not found at `{file}`\n"
-                    "! Are you sure it has been created?\n"
-                    "! If this is your first time running, please use `build`."
-                )
-                print(err)
-                sys.exit(0)
+                if self.engine is not None:
+                    self.engine.unregister(name)
 
 
 
-    def run_queries(self, queries=None):
+    def build_datasets(self, datasets, jobs=1, force=False):
         """
-        
+        Build the selected datasets (or all), each as soon as the datasets its SQL reads from are ready.
+        Unselected datasets are only loaded from disk if a selected dataset is built from them.
+        Datasets whose fingerprints match their manifests are not rebuilt, unless `force`.
         """
-        print("\nProcessing queries...")
+        print("\nBuilding datasets for run...")
+        self.force = force
 
         # Retrieve the queries configs to process from the Configs.
-        if self.query_configs is None:
-            print("@ No queries found!")
+        if self.dataset_configs is None:
+            print("@ No datasets found!")
             return
-    
-        # Iterate and build each query.
-        for query in self.query_configs:
 
-            # Process selected queries if specified. Otherwise, run all.
-            if queries and query.name not in queries:
-                continue
+        names = [config.name for config in self.dataset_configs]
+        scheduler = Scheduler(jobs)
+
+        # Process selected datasets if specified. Otherwise, build all.
+        selected = [
+            config for config in self.dataset_configs
+            if not datasets or config.name in datasets
+        ]
 
-            try:
-                query.run(self.datasets)
-                print(f"* Query `{query.name}` completed: {query.file}")
+        for config in selected:
+            dependencies = config.get_dependencies(names)
+            self.retain_datasets(dependencies)
 
-            except Exception as err:
-                print(f"! Query `{query.name}` failed build: {err}")            
+            scheduler.add(
+                config.name, partial(self.build_dataset, config, dependencies),
+                depends_on=dependencies, label=f"Dataset `{config.name}`"
+            )
 
+        for config in self.dataset_configs:
+            if config not in selected and config.name in self.references:
+                scheduler.add(
+                    config.name, partial(self.load_dataset, config),
+                    label=f"Dataset `{config.name}`"
+                )
 
+        scheduler.run()
 
-    def run_relplots(self, relplots=None):
+
+
+    def build_dataset(self, config, dependencies):
         """
-        
+        Build a single dataset from the configs and save it to its file.
+        It is only kept in memory if another dataset is built from it.
         """
-        print("\nProcessing relplots...")
+        try:
+            # Upstream datasets have completed, so their fingerprints are known.
+            fingerprint = self.get_fingerprint(config, dependencies)
 
-        # Retrieve the queries configs to process from the Configs.
-        if self.query_configs is None:
-            print("@ No relplots found!")
-            return
-    
-        # Iterate and build each query.
-        for relplot in self.relplot_configs:
+            if not self.force and fingerprint_utils.is_up_to_date(config.file, fingerprint):
+                print(f"@ Dataset `{config.name}` is up to date: `{config.file}`")
+                self.fingerprints[config.name] = fingerprint
 
-            # Process selected queries if specified. Otherwise, run all.
-            if relplots and relplot.name not in relplots:
-                continue
+                if config.name in self.references:
+                    self.load_dataset(config)
+                return
+
+            _dataset = config.build_dataset(dict(self.datasets), engine=self.engine, force=self.force)
+            Dataset.save(_dataset, config.file, info=True)
+            fingerprint_utils.write_manifest(config.file, fingerprint)
+
+            self.fingerprints[config.name] = fingerprint
 
-            try:
-                relplot.run(self.datasets)
-                print(f"* Relplot `{relplot.name}` completed: {relplot.file}")
+            if config.name in self.references:
+                self.register_dataset(config.name, _dataset)
 
-            except Exception as err:
-                print(f"! Relplot `{relplot.name}` failed build: {err}")
-            
+        finally:
+            self.release_datasets(dependencies)
 
 
-    def run_screenplays(self, screenplays=None):
+
+    def load_dataset(self, config):
         """
-        
+        Load a single dataset from its file, exiting if it has not been built yet.
         """
-        print("\nProcessing screenplays...")
+        try:
+            name = config.name
+            file = config.file
 
-        # Retrieve the queries configs to process from the Configs.
-        if self.screenplay_configs is None:
-            print("@ No screenplays found!")
-            return
-    
-        # Iterate and build each query.
-        for screenplay in self.screenplay_configs:
+            _dataset = config.load_dataset(file, columns=self.columns.get(name))
+            self.register_dataset(name, _dataset)
+            print(f"* Dataset `{name}` loaded: `{file}`")
+
+        except Exception as err:
+            print(
+                f"! Dataset `{name}` not found at `{file}`\n"
+                "! Are you sure it has been created?\n"
+                "! If this is your first time running, please use `build`."
+            )
+            print(err)
+            sys.exit(0)
+
+
+
+    def run(self, runs, jobs=1, force=False):
+        """
+        Load the datasets and complete the selected runs as one DAG.
+
+        `runs` maps each run type to a list of names (empty to run all of that type), or None to skip it.
+        Each run starts as soon as the datasets it reads from are loaded.
+        With `jobs > 1`, independent steps run in that many threads, and relplots and wordclouds render in that many processes.
+        Runs whose fingerprints match their manifests are skipped, unless `force`.
+
+        Only datasets referenced by a scheduled run are loaded, and only with the columns those runs could read.
+        Each is released once the last run reading from it completes.
+        """
+        print("\nLoading datasets and processing runs...")
+        self.force = force
+
+        names = [config.name for config in self.dataset_configs or []]
+        scheduler = Scheduler(jobs)
+        run_tasks = []
+
+        for run_type, selected in runs.items():
+
+            # Ignore undefined runs.
+            if selected is None:
+                continue
 
-            # Process selected queries if specified. Otherwise, run all.
-            if screenplays and screenplay.name not in screenplays:
+            # Retrieve the run configs to process from the Configs.
+            if self.run_configs[run_type] is None:
+                print(f"@ No {run_type} found!")
                 continue
 
-            try:
-                screenplay.run(self.datasets)
-                print(f"* Screenplay `{screenplay.name}` completed: {screenplay.folder}")
+            for run in self.run_configs[run_type]:
+
+                # Process selected runs if specified. Otherwise, run all.
+                if selected and run.name not in selected:
+                    continue
+
+                run_dataset = Dataset(**run.dataset)
+                dependencies = run_dataset.get_dependencies(names)
+                fingerprint = self.get_fingerprint(run, dependencies)
+                label = f"{self.RUN_TYPES[run_type]} `{run.name}`"
+                output = run.get_output()
+
+                if not self.force and fingerprint_utils.is_up_to_date(output, fingerprint):
+                    print(f"@ {label} is up to date: {run.file if run.partition_by else output}")
+                    continue
+
+                self.retain_datasets(dependencies)
+                self.add_referenced_columns(dependencies, run_dataset.get_referenced_columns())
+
+                run_tasks.append((
+                    (run_type, run.name),
+                    partial(self.complete_run, run_type, run, fingerprint, dependencies),
+                    {('datasets', name) for name in dependencies},
+                    label,
+                ))
+
+        # Datasets are loaded first (in config order), but only if a scheduled run reads from them.
+        for config in self.dataset_configs or []:
+            if config.name in self.references:
+                scheduler.add(
+                    ('datasets', config.name), partial(self.load_dataset, config),
+                    label=f"Dataset `{config.name}`"
+                )
+
+        for key, func, depends_on, label in run_tasks:
+            scheduler.add(key, func, depends_on=depends_on, label=label)
+
+        # Threads share the GIL, so rendering relplots and wordclouds (the CPU-heavy steps) is moved into processes.
+        # Workers are spawned rather than forked, since a fork while another thread holds a lock (e.g. mid-import) deadlocks the worker.
+        if jobs > 1:
+            self.executor = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'))
+
+            # Renders are queued at most two per worker (across all runs), so each worker has its next render ready
+            # while the data waiting to be sent stays bounded, however many partitions a run has.
+            self.render_slots = threading.BoundedSemaphore(2 * jobs)
 
-            except Exception as err:
-                print(f"! Screenplay `{screenplay.name}` failed build: {err}")
+        try:
+            scheduler.run()
 
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+                self.render_slots = None
 
-    
-    def run_wordclouds(self, wordclouds=None):
+            # Release the term-freqs shared across wordclouds (only if any were built).
+            tfidf_utils = sys.modules.get('adastra_analysis.runs.util.tfidf_utils')
+            if tfidf_utils is not None:
+                tfidf_utils.clear_shared_term_freqs()
+
+
+
+    def add_referenced_columns(self, names, columns):
         """
-        
+        Widen the columns to load from each named dataset. `columns=None` requires every column.
         """
-        print("\nProcessing wordclouds...")
+        for name in names:
+            if columns is None or (name in self.columns and self.columns[name] is None):
+                self.columns[name] = None
+            else:
+                self.columns[name] = self.columns.get(name, set()) | columns
 
-        # Retrieve the queries configs to process from the Configs.
-        if self.wordcloud_configs is None:
-            print("@ No wordclouds found!")
-            return
-    
-        # Iterate and build each query.
-        for wordcloud in self.wordcloud_configs:
 
-            # Process selected queries if specified. Otherwise, run all.
-            if wordclouds and wordcloud.name not in wordclouds:
-                continue
 
-            try:
-                wordcloud.run(self.datasets)
-                print(f"* Screenplay `{wordcloud.name}` completed: {wordcloud.file}")
+    def complete_run(self, run_type, run, fingerprint, dependencies):
+        """
+        Complete a single run, record its fingerprint, and notify the user. Errors are reported by the scheduler.
+        """
+        try:
+            # Data and word-freqs are built in this process (word-freqs share the fitted term-freqs).
+            # Runs build from a snapshot of the datasets, since building a named dataset writes it into the dict
+            # while other threads may be loading or releasing datasets.
+            # Each scheduler thread waits on the renders of its own run (one per partition).
+            if run_type in self.RENDERERS and self.executor is not None:
+                renders = run.get_renders(run.build(dict(self.datasets), engine=self.engine))
+
+                module_name, func_name = self.RENDERERS[run_type]
+                render_func = getattr(importlib.import_module(module_name), func_name)
+
+                futures = []
+                for render in renders:
+                    run.prepare_directories(render['file'])
+
+                    # Wait for a free slot; it is released as soon as the render finishes (or fails).
+                    self.render_slots.acquire()
+                    try:
+                        future = self.executor.submit(render_func, **render)
+                    except BaseException:
+                        self.render_slots.release()
+                        raise
+
+                    future.add_done_callback(lambda _: self.render_slots.release())
+                    futures.append(future)
+
+                files = [future.result() for future in futures]
+
+            else:
+                files = run.run(dict(self.datasets), engine=self.engine)
+
+        finally:
+            self.release_datasets(dependencies)
+
+        # Partitioned runs and screenplays record the stats of every file they wrote.
+        if run.partition_by:
+            fingerprint_utils.write_manifest(run.get_output(), fingerprint, files=files)
+            print(f"* {self.RUN_TYPES[run_type]} `{run.name}` completed: {len(files)} files for `{run.file}`")
+
+        elif run_type == 'screenplays':
+            fingerprint_utils.write_manifest(run.get_output(), fingerprint, files=files)
+            print(f"* {self.RUN_TYPES[run_type]} `{run.name}` completed: {len(files)} files in `{run.get_output()}`")
 
-            except Exception as err:
-                print(f"! Wordcloud `{wordcloud.name}` failed build: {err}")
+        else:
+            fingerprint_utils.write_manifest(run.get_output(), fingerprint)
+            print(f"* {self.RUN_TYPES[run_type]} `{run.name}` completed: {run.get_output()}")
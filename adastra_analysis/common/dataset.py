@@ -1,9 +1,13 @@
 import sys
 
+import numpy as np
 import pandas as pd
-import pandasql as psql
+
+# PandaSQL (and SQLAlchemy) are only imported when a query runs without a query engine.
 
 from adastra_analysis.common.run import Run
+from adastra_analysis.common.util import filter_utils
+from adastra_analysis.common.util import sql_utils
 
 
 class Dataset(Run):
@@ -28,24 +32,21 @@ class Dataset(Run):
         self.result = None
 
 
-    def build_dataset(self, datasets):
+    def build_dataset(self, datasets, engine=None, force=False):
         """
         Note: This relies on Python passing the same `datasets` around in memory.
+        (`force` only matters to datasets that reuse parts of their previous build.)
         """
 
-        _datasets = datasets.copy()
-
-        # OPTIONAL: Filter the datasets before creating this one.
-        if self.filters and self.sql:
-            _datasets = Dataset.filter_datasets(self.filters, _datasets)
-
         # REQUIRED
+        # (`file` is also where a built dataset is saved, so `sql` must take precedence over it.)
         if self.dataset_args:
             dataset = Dataset.data_to_dataset(**self.dataset_args)
+        elif self.sql:
+            # OPTIONAL: `filters` are applied to the datasets before querying them.
+            dataset = Dataset.query_datasets(self.sql, datasets, filters=self.filters, engine=engine)
         elif self.file:
             dataset = Dataset.load_dataset(self.file)
-        elif self.sql:
-            dataset = Dataset.query_datasets(self.sql, _datasets)
         elif self.name:
             dataset = datasets.get(self.name)
             if dataset is None:
@@ -61,9 +62,65 @@ class Dataset(Run):
         return dataset
 
 
+    def build_chunks(self, datasets, chunk_size, engine=None):
+        """
+        Yield the dataset about `chunk_size` rows at a time.
+        SQL datasets are read from the query engine's cursor as they are consumed; other datasets are built whole and sliced.
+        """
+        if self.sql and not self.dataset_args and engine is not None:
+            yield from engine.query_chunks(self.sql, datasets, filters=self.filters, chunk_size=chunk_size)
+            return
+
+        dataset = self.build_dataset(datasets, engine=engine)
+        for start in range(0, len(dataset), chunk_size):
+            yield dataset.iloc[start:start + chunk_size]
+
+
+    def get_dependencies(self, names):
+        """
+        Infer which of the dataset `names` this dataset is built from.
+        This follows the same precedence as `build_dataset`.
+        """
+        if self.dataset_args:
+            return set()
+
+        elif self.sql:
+            dependencies = sql_utils.get_referenced_tables(self.sql, names)
+            dependencies.update(
+                filter['name'] for filter in (self.filters or []) if filter['name'] in names
+            )
+            return dependencies
+
+        elif self.file:
+            return set()
+
+        elif self.name in names:
+            return {self.name}
+
+        return set()
+
+
+    def get_referenced_columns(self):
+        """
+        Identifiers in this dataset's SQL and filters that could be columns of its upstream datasets.
+        Returns None if every column may be read (`select *`, a `natural join`, or no SQL at all).
+        """
+        if self.dataset_args:
+            return set()
+
+        if not self.sql or sql_utils.selects_all(self.sql):
+            return None
+
+        identifiers = sql_utils.get_identifiers(self.sql)
+        for filter in self.filters or []:
+            identifiers |= sql_utils.get_identifiers(filter['where'])
+
+        return identifiers
+
+
     ###
     @staticmethod
-    def filter_datasets(filters, datasets):
+    def filter_datasets(filters, datasets, engine=None):
         """
         
         """
@@ -75,7 +132,7 @@ class Dataset(Run):
             where = filter['where']
 
             dataset = _datasets.get(name)
-            dataset = Dataset.filter_where(dataset, where)
+            dataset = Dataset.filter_where(dataset, where, engine=engine)
 
             _datasets[name] = dataset
 
@@ -83,13 +140,21 @@ class Dataset(Run):
 
 
     @staticmethod
-    def query_datasets(sql, datasets):
+    def query_datasets(sql, datasets, filters=None, engine=None):
         """
-        
+        Run SQL against the datasets, after applying any filters to them.
+        Use the persistent query engine if provided (which memoizes results); otherwise, fall back to a one-off PandaSQL session.
         """
+        if engine is not None:
+            return engine.query(sql, datasets, filters=filters)
+
+        if filters:
+            datasets = Dataset.filter_datasets(filters, datasets)
+
         for name, _dataset in datasets.items():
             exec(f"{name} = _dataset")
 
+        import pandasql as psql
         return psql.sqldf(sql)
 
 
@@ -109,43 +174,105 @@ class Dataset(Run):
 
 
     @staticmethod
-    def load_dataset(file):
+    def is_parquet(file):
         """
-        
+        Datasets are stored as Parquet if their file has a `.parquet` extension, and as JSON lines otherwise.
+        """
+        return str(file).lower().endswith('.parquet')
+
+
+    @staticmethod
+    def load_dataset(file, columns=None):
+        """
+        Read a dataset in the format implied by its file extension.
+
+        If `columns` is provided, only those columns are kept (matched case-insensitively, like SQL).
+        Parquet files skip reading the other columns entirely.
         """
-        return pd.read_json(
+        if Dataset.is_parquet(file):
+            if columns is not None:
+                import pyarrow.parquet as pq
+                columns = Dataset._project_columns(pq.read_schema(file).names, columns)
+
+            return pd.read_parquet(file, columns=columns)
+
+        dataset = pd.read_json(
             file,
             orient='records',
             lines=True
         )
 
+        if columns is not None:
+            dataset = dataset[Dataset._project_columns(dataset.columns, columns)]
+
+        return dataset
+
+
+    @staticmethod
+    def _project_columns(available, columns):
+        """
+        Keep the available columns named in `columns`, in their original order.
+        """
+        columns = {column.lower() for column in columns}
+        return [column for column in available if column.lower() in columns]
+
 
     @staticmethod
-    def filter_where(dataset, where_clause):
+    def filter_where(dataset, where_clause, engine=None):
         """
         Apply one or more where-clauses to the dataset, using the alias provided in the PandaSQL query.
+        Simple clauses are compiled into vectorized masks; anything else is run as SQL (straight from the dataset).
+        """
+        if not where_clause:
+            return dataset.copy()
+
+        mask = filter_utils.where_to_mask(dataset, where_clause)
+
+        if mask is not None:
+            return dataset[mask].reset_index(drop=True)
+
+        # Allow either a str or List[str].
+        sql = f"""
+            select * from _dataset
+            where {where_clause}
+        """
+
+        if engine is not None:
+            return engine.query(sql, {'_dataset': dataset})
+
+        import pandasql as psql
+        _dataset = dataset
+        return psql.sqldf(sql)
+
+
+    @staticmethod
+    def where_mask(dataset, where_clause, engine=None):
         """
-        _dataset = dataset.copy()
+        Evaluate a where-clause as a boolean mask over the rows of the dataset, without filtering it.
+        Clauses that cannot be compiled are run as SQL, and the matching rows are mapped back by position.
+        """
+        mask = filter_utils.where_to_mask(dataset, where_clause)
+
+        if mask is not None:
+            return mask
 
-        if where_clause:
-            
-            # Allow either a str or List[str].
-            _dataset = psql.sqldf(f"""
-                select * from _dataset
-                where {where_clause}
-            """)
-    
-        return _dataset
+        _dataset = dataset.assign(_row_idx=np.arange(len(dataset)))
+        matched = Dataset.filter_where(_dataset, where_clause, engine=engine)['_row_idx']
+
+        return pd.Series(np.isin(_dataset['_row_idx'], matched), index=dataset.index)
 
 
     @staticmethod
     def save(dataset, file, info=False):
         """
-        Write the dataset as JSON lines.
+        Write the dataset in the format implied by its file extension (Parquet or JSON lines).
         """
         Run.prepare_directories(file)
 
-        dataset.to_json(file, orient='records', lines=True)
+        if Dataset.is_parquet(file):
+            dataset.to_parquet(file, index=False)
+        else:
+            dataset.to_json(file, orient='records', lines=True)
         
         if info:
             print(f"* Dataset saved: {file}")
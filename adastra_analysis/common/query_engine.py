@@ -0,0 +1,403 @@
+import math
+import sys
+import sqlite3
+import threading
+
+import pandas as pd
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from adastra_analysis.common.util import sql_utils
+
+
+class QueryEngine:
+    """
+    Long-lived SQL session shared by every Dataset and Run in an analysis.
+
+    Datasets are registered once under their names and handed to the backend the first time
+    a query needs them. They are only handed over again when a new DataFrame is registered.
+
+    Results of queries over registered datasets are memoized (up to `cache_size` of them, least recently used
+    evicted first), so configs that repeat the same SQL only compute it once.
+    """
+    def __init__(self, cache_size=128):
+        self.registered = {}  # Name to the canonical DataFrame for that name.
+        self.written = {}     # Name to the DataFrame currently visible to the backend.
+
+        self.versions = {}    # Name to the version of the registered DataFrame, counted across all names.
+        self.version = 0
+
+        self.results = OrderedDict()  # (Normalized SQL, filters, dataset versions) to result, oldest first.
+        self.cache_size = cache_size
+
+        # Datasets and runs may be scheduled concurrently; the backend connection is not thread-safe.
+        self.lock = threading.RLock()
+
+
+    def get_backend(self):
+        """
+        Identify the backend and its version; results can differ between them (e.g. types and rounding).
+        """
+        raise NotImplementedError
+
+
+    def register(self, name, dataset):
+        """
+        Mark the dataset as the canonical version of `name`.
+        The backend table is (re)written lazily on the next query that needs it.
+        """
+        with self.lock:
+            self.registered[name] = dataset
+
+            self.version += 1
+            self.versions[name] = self.version
+            self._evict_results(name)
+
+
+    def unregister(self, name):
+        """
+        Forget a dataset and remove it from the backend.
+        """
+        with self.lock:
+            self.registered.pop(name, None)
+            self.versions.pop(name, None)
+            self._evict_results(name)
+
+            if self.written.pop(name, None) is not None:
+                self._drop_table(name)
+
+
+    def query(self, sql, datasets, filters=None):
+        """
+        Run the SQL against the registered datasets, after applying any `filters` to them.
+
+        Any dataset that is not the registered version of its name (e.g. a one-off DataFrame)
+        shadows the registered table for this query only.
+        Only datasets the SQL actually references are handed to the backend.
+
+        Filters are pushed into the query as views over the datasets, so no filtered copies are made.
+        Results are shared between identical queries. They are handed out as shallow copies, which share their column arrays
+        with the memoized result (pandas may write straight into those when a column is assigned), so callers must build
+        new frames (e.g. with `assign`) instead of assigning into them.
+        """
+        datasets, wheres = self._get_referenced_datasets(sql, datasets, filters)
+
+        with self.lock:
+            return self._memoize(
+                self._get_query_key(sql, datasets, filters),
+                lambda: self._query(sql, datasets, wheres)
+            )
+
+
+    def query_chunks(self, sql, datasets, filters=None, chunk_size=10000):
+        """
+        Run the SQL like `query`, but yield the result about `chunk_size` rows at a time as the backend produces them,
+        so the whole result is never held in memory at once.
+
+        Chunked results are not memoized. The engine is held until the last chunk is read or the generator is closed,
+        so other queries wait in the meantime.
+        """
+        datasets, wheres = self._get_referenced_datasets(sql, datasets, filters)
+
+        with self.lock:
+            yield from self._query_chunks(sql, datasets, wheres, chunk_size)
+
+
+    def _query(self, sql, datasets, wheres):
+        """
+        Run the SQL with each dataset visible under its name, limited to the rows matching its where-clause in `wheres`.
+        """
+        raise NotImplementedError
+
+
+    def _query_chunks(self, sql, datasets, wheres, chunk_size):
+        raise NotImplementedError
+
+
+    def _drop_table(self, name):
+        raise NotImplementedError
+
+
+    @staticmethod
+    def _get_referenced_datasets(sql, datasets, filters=None):
+        """
+        Keep only the datasets the SQL references, and combine the where-clauses of the filters on each.
+        """
+        referenced = sql_utils.get_referenced_tables(sql, datasets)
+        datasets = {name: dataset for name, dataset in datasets.items() if name in referenced}
+
+        # Filters of the same dataset are combined, as if applied one after another.
+        wheres = {}
+        for filter in filters or []:
+            if filter['name'] in datasets:
+                wheres.setdefault(filter['name'], []).append(f"({filter['where']})")
+
+        wheres = {name: ' AND '.join(clauses) for name, clauses in wheres.items()}
+        return datasets, wheres
+
+
+    ### Internal helpers for memoizing results.
+    def _get_query_key(self, sql, datasets, filters):
+        """
+        Identify a query by its normalized SQL, its filters, and the versions of the datasets it reads.
+        Returns None if it reads anything other than registered datasets, which cannot be versioned.
+        """
+        names = set(datasets)
+
+        if any(name not in self.registered or self.registered[name] is not datasets.get(name) for name in names):
+            return None
+
+        return (
+            sql_utils.normalize_sql(sql),
+            tuple(
+                (filter['name'], sql_utils.normalize_sql(filter['where']))
+                for filter in filters or [] if filter['name'] in names
+            ),
+            tuple((name, self.versions[name]) for name in sorted(names)),
+        )
+
+
+    def _memoize(self, key, func):
+        """
+        Return the memoized result under `key`, computing it if missing. A key of None is never memoized.
+        """
+        if key is not None and key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key].copy(deep=False)
+
+        result = func()
+
+        if key is not None and self.cache_size:
+            self.results[key] = result
+
+            while len(self.results) > self.cache_size:
+                self.results.popitem(last=False)
+
+        return result.copy(deep=False)
+
+
+    def _evict_results(self, name):
+        """
+        Drop the memoized results that read from any version of `name`.
+        """
+        for key in [key for key in self.results if name in dict(key[-1])]:
+            del self.results[key]
+
+
+
+class SqliteQueryEngine(QueryEngine):
+    """
+    Row-oriented backend: datasets are copied once into an in-memory SQLite database.
+    """
+    def __init__(self, cache_size=128):
+        super().__init__(cache_size=cache_size)
+        self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+
+
+    def get_backend(self):
+        return {'backend': 'sqlite', 'version': sqlite3.sqlite_version}
+
+
+    def _query(self, sql, datasets, wheres):
+        with self._expose(datasets, wheres):
+            return pd.read_sql_query(sql, self.connection)
+
+
+    def _query_chunks(self, sql, datasets, wheres, chunk_size):
+        # Rows are read from the cursor as the chunks are consumed.
+        with self._expose(datasets, wheres):
+            yield from pd.read_sql_query(sql, self.connection, chunksize=chunk_size)
+
+
+    @contextmanager
+    def _expose(self, datasets, wheres):
+        """
+        Make each dataset visible under its name (filtered by its where-clause) for the duration of a query.
+        """
+        shadows = []
+        views = []
+
+        for name, dataset in datasets.items():
+            where = wheres.get(name)
+
+            if self.registered.get(name) is dataset:
+                self._write_table(name, dataset)
+
+                if where:
+                    self._create_view(name, f'main."{name}"', where)
+                    views.append(name)
+
+            else:
+                self._write_shadow(name, dataset, where)
+                shadows.append(name)
+
+        try:
+            yield
+
+        finally:
+            for name in views:
+                self._drop_view(name)
+
+            for name in shadows:
+                self._drop_shadow(name)
+
+
+    ### Internal helpers for managing tables.
+    def _write_table(self, name, dataset):
+        """
+        Write the dataset as a persistent table, unless it is already stored.
+        """
+        if self.written.get(name) is dataset:
+            return
+
+        dataset.to_sql(name, self.connection, if_exists='replace', index=False)
+        self.written[name] = dataset
+
+
+    def _drop_table(self, name):
+        self.connection.execute(f'drop table if exists "{name}"')
+
+
+    def _create_view(self, name, source, where=None):
+        """
+        Expose the (filtered) source under `name` through a temp view.
+        SQLite resolves unqualified names against the temp schema first, so this shadows any table of the same name.
+        """
+        self.connection.execute(f'create temp view "{name}" as select * from {source} where {where or "1"}')
+
+
+    def _drop_view(self, name):
+        self.connection.execute(f'drop view if exists temp."{name}"')
+
+
+    def _write_shadow(self, name, dataset, where=None):
+        """
+        Write the dataset to a scratch table and expose it under `name` through a temp view.
+        """
+        dataset.to_sql(f'_shadow_{name}', self.connection, if_exists='replace', index=False)
+        self._create_view(name, f'"_shadow_{name}"', where)
+
+
+    def _drop_shadow(self, name):
+        """
+        Remove a temporary shadow created by `_write_shadow`.
+        """
+        self._drop_view(name)
+        self.connection.execute(f'drop table if exists "_shadow_{name}"')
+
+
+
+class DuckdbQueryEngine(QueryEngine):
+    """
+    Columnar backend: DuckDB scans the pandas DataFrames in place, using all available cores.
+    """
+    def __init__(self, cache_size=128):
+        super().__init__(cache_size=cache_size)
+
+        import duckdb
+        self.connection = duckdb.connect(':memory:')
+        self.duckdb_version = duckdb.__version__
+
+
+    def get_backend(self):
+        return {'backend': 'duckdb', 'version': self.duckdb_version}
+
+
+    def _query(self, sql, datasets, wheres):
+        with self._expose(datasets, wheres):
+            return self.connection.execute(sql).df()
+
+
+    def _query_chunks(self, sql, datasets, wheres, chunk_size):
+        # DuckDB hands results over in vectors of 2048 rows, so chunks are rounded up to whole vectors.
+        vectors_per_chunk = max(1, math.ceil(chunk_size / 2048))
+
+        with self._expose(datasets, wheres):
+            result = self.connection.execute(sql)
+
+            while True:
+                chunk = result.fetch_df_chunk(vectors_per_chunk)
+                if chunk.empty:
+                    break
+
+                yield chunk
+
+
+    @contextmanager
+    def _expose(self, datasets, wheres):
+        """
+        Make each dataset visible under its name (filtered by its where-clause) for the duration of a query.
+        """
+        # Registration is zero-copy, so shadows are just re-registrations under the same name.
+        # The canonical dataset is swapped back in by the next query that uses it.
+        views = []
+
+        for name, dataset in datasets.items():
+            where = wheres.get(name)
+
+            # Filtered datasets are scanned in place under a scratch name, with only the matching rows visible under `name`.
+            if where:
+                self.connection.register(f'_unfiltered_{name}', dataset)
+                self.connection.execute(
+                    f'create or replace temp view "{name}" as select * from "_unfiltered_{name}" where {where}'
+                )
+                self.written.pop(name, None)
+                views.append(name)
+
+            elif self.written.get(name) is not dataset:
+                self.connection.register(name, dataset)
+                self.written[name] = dataset
+
+        try:
+            yield
+
+        finally:
+            for name in views:
+                self.connection.execute(f'drop view if exists "{name}"')
+                self.connection.unregister(f'_unfiltered_{name}')
+
+
+    def _drop_table(self, name):
+        self.connection.unregister(name)
+
+
+
+QUERY_ENGINES = {
+    'sqlite': SqliteQueryEngine,
+    'duckdb': DuckdbQueryEngine,
+}
+
+
+def get_query_engine(backend='sqlite', cache_size=128):
+    """
+    Instantiate the query engine named in the configs, memoizing up to `cache_size` query results.
+    `pandasql` returns None, which falls back to a one-off PandaSQL session per query.
+    """
+    if backend == 'pandasql':
+        return None
+
+    if backend not in QUERY_ENGINES:
+        print(
+            f"! Unknown query engine `{backend}`!\n"
+            f"! Choose one of: {', '.join(['pandasql', *QUERY_ENGINES])}"
+        )
+        sys.exit(0)
+
+    try:
+        return QUERY_ENGINES[backend](cache_size=cache_size)
+
+    except ImportError as err:
+        print(f"! Query engine `{backend}` is unavailable ({err}); falling back to `sqlite`.")
+        return SqliteQueryEngine(cache_size=cache_size)
+
+
+def get_engine_backend(engine):
+    """
+    Identify the backend answering queries for the engine returned by `get_query_engine`.
+    Without an engine, PandaSQL runs each query in a fresh SQLite database.
+    """
+    if engine is None:
+        return {'backend': 'pandasql', 'version': sqlite3.sqlite_version}
+
+    return engine.get_backend()
@@ -5,6 +5,13 @@ class Run:
     """
     
     """
+    # Column(s) to split the run's data by, writing one output per group (see `get_partitions`).
+    partition_by = None
+
+    # Settings that do not change the output, and so are left out of the run's fingerprint.
+    performance_settings = ()
+
+
     def __init__(
         self,
 
@@ -17,15 +24,80 @@ class Run:
         self.dataset = dataset
 
 
-    def build(self, datasets=None):
+    def build(self, datasets=None, engine=None):
         pass
 
     def save(self):
         pass
 
-    def run(self, datasets):
-        result = self.build(datasets)
-        self.save(result)
+    def run(self, datasets, engine=None):
+        """
+        Build and save the run, returning the files written (if `save` reports them).
+        """
+        result = self.build(datasets, engine=engine)
+        return self.save(result)
+
+    def get_sources(self):
+        """
+        Files read directly by this run (outside of datasets); their contents are part of its fingerprint.
+        """
+        return []
+
+    def get_code_version(self):
+        """
+        Identify library code this run's output depends on beyond its config; it is part of its fingerprint.
+        """
+        return None
+
+
+    def get_output(self):
+        """
+        The output the run's fingerprint manifest is kept for.
+        Partitioned runs write many files from a templated `file`, so their manifest is named for the run instead,
+        in the template's first fixed directory.
+        """
+        if not self.partition_by:
+            return self.file
+
+        directory = os.path.dirname(self.file.split('{', 1)[0])
+        return os.path.join(directory, self.name)
+
+
+    ### Partitioned runs
+    def get_partition_columns(self):
+        if isinstance(self.partition_by, str):
+            return [self.partition_by]
+        return list(self.partition_by or [])
+
+
+    def get_partitions(self, data):
+        """
+        Split the data by `partition_by` in a single pass, yielding the values of each group (by column) and its rows.
+        Unpartitioned runs yield the data once, with no values.
+        """
+        columns = self.get_partition_columns()
+
+        if not columns:
+            yield {}, data
+            return
+
+        # A single column is grouped by name, since pandas warns about (and will change) grouping by a list of one.
+        by = columns[0] if len(columns) == 1 else columns
+
+        for keys, group in data.groupby(by, sort=True):
+            keys = keys if isinstance(keys, tuple) else (keys,)
+            yield dict(zip(columns, keys)), group.reset_index(drop=True)
+
+
+    @staticmethod
+    def format_partition(template, values):
+        """
+        Fill a template (e.g. `file: queries/{file}.jsonl`) with the values of a partition.
+        """
+        if template is None or not values:
+            return template
+
+        return template.format(**values)
 
 
     @classmethod
@@ -45,5 +117,6 @@ class Run:
         directory = os.path.dirname(file)
 
         if not os.path.exists(directory):
-            os.makedirs(directory)
+            # Concurrent runs may race to create the same directory.
+            os.makedirs(directory, exist_ok=True)
             print(f"@ Created new directory: `{directory}`")
\ No newline at end of file
@@ -0,0 +1,124 @@
+import sys
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Scheduler:
+    """
+    Execute a DAG of tasks, starting each as soon as everything it depends on has completed.
+
+    Independent tasks run concurrently in a pool of `jobs` threads.
+    With a single job, tasks run in the main thread in the order they were added.
+    """
+    def __init__(self, jobs=1):
+        self.jobs = max(1, jobs or 1)
+        self.tasks = {}  # Key to (func, depends_on, label), in insertion order.
+
+
+    def add(self, key, func, depends_on=(), label=None):
+        """
+        Register a task. Dependencies on keys that are never added are ignored.
+        """
+        self.tasks[key] = (func, set(depends_on), label or str(key))
+
+
+    def run(self):
+        """
+        Run every task. A failed task is reported and all of its dependents are skipped.
+        `SystemExit` raised by a task stops the scheduler and is re-raised once running tasks finish.
+        """
+        pending = {
+            key: {dep for dep in depends_on if dep in self.tasks and dep != key}
+            for key, (_, depends_on, _) in self.tasks.items()
+        }
+        self.completed = set()
+        self.failed = set()
+        self.exit = None
+
+        if self.jobs == 1:
+            self._run_serial(pending)
+        else:
+            self._run_parallel(pending)
+
+        if self.exit is not None:
+            raise self.exit
+
+
+    def _run_serial(self, pending):
+        while pending and self.exit is None:
+            self._skip_failed_dependents(pending)
+
+            key = next((key for key, deps in pending.items() if deps <= self.completed), None)
+            if key is None:
+                self._raise_cycle(pending)
+
+            del pending[key]
+            try:
+                self.tasks[key][0]()
+                self._finish(key, None)
+            except BaseException as err:
+                self._finish(key, err)
+
+
+    def _run_parallel(self, pending):
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while (pending and self.exit is None) or running:
+                self._skip_failed_dependents(pending)
+
+                # Submit every task whose dependencies have completed, up to the size of the pool.
+                if self.exit is None:
+                    ready = [key for key, deps in pending.items() if deps <= self.completed]
+
+                    for key in ready[:self.jobs - len(running)]:
+                        del pending[key]
+                        running[executor.submit(self.tasks[key][0])] = key
+
+                if not running:
+                    if pending and self.exit is None:
+                        self._raise_cycle(pending)
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self._finish(running.pop(future), future.exception())
+
+
+    def _finish(self, key, err):
+        """
+        Record the outcome of a task.
+        """
+        if err is None:
+            self.completed.add(key)
+            return
+
+        self.failed.add(key)
+
+        if isinstance(err, SystemExit):
+            self.exit = err
+        elif isinstance(err, KeyboardInterrupt):
+            raise err
+        else:
+            print(f"! {self.tasks[key][2]} failed build: {err}")
+
+
+    def _skip_failed_dependents(self, pending):
+        """
+        Drop (transitively) every pending task downstream of a failure.
+        """
+        while True:
+            skipped = [key for key, deps in pending.items() if deps & self.failed]
+            if not skipped:
+                return
+
+            for key in skipped:
+                print(f"! {self.tasks[key][2]} skipped: an upstream step failed.")
+                self.failed.add(key)
+                del pending[key]
+
+
+    def _raise_cycle(self, pending):
+        labels = ', '.join(self.tasks[key][2] for key in pending)
+        print(f"! Circular dependency between: {labels}")
+        sys.exit(0)
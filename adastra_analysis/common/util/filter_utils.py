@@ -0,0 +1,375 @@
+import functools
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Compile the simple where-clauses used throughout the configs into vectorized Pandas masks.
+# Anything outside this grammar returns None, and the caller falls back to SQL.
+#
+#   expr      : conjunct (OR conjunct)*
+#   conjunct  : predicate (AND predicate)*
+#   predicate : '(' expr ')' | TRUE | FALSE
+#             | operand
+#             | operand IS [NOT] (TRUE | FALSE | NULL)
+#             | operand (= | == | != | <> | < | <= | > | >=) operand
+#             | operand [NOT] BETWEEN operand AND operand
+#             | operand [NOT] IN '(' operand (, operand)* ')'
+#
+# Every predicate evaluates NULL as False, which matches SQL as long as there is no negation over it.
+# This is why bare `NOT` is not supported, and why negated predicates exclude nulls explicitly.
+
+_TOKEN_REGEX = re.compile(r"""
+    \s*(?:
+        (?P<number>-?(?:\d+\.\d*|\.\d+|\d+))
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<quoted>"(?:[^"]|"")*")
+      | (?P<op><=|>=|<>|!=|==|=|<|>|\(|\)|,)
+      | (?P<word>[A-Za-z_][A-Za-z_0-9]*)
+    )\s*
+""", re.VERBOSE)
+
+_KEYWORDS = {'AND', 'OR', 'NOT', 'IS', 'IN', 'BETWEEN', 'TRUE', 'FALSE', 'NULL'}
+
+_COMPARISONS = {
+    '=' : lambda x, y: x == y,
+    '==': lambda x, y: x == y,
+    '!=': lambda x, y: x != y,
+    '<>': lambda x, y: x != y,
+    '<' : lambda x, y: x < y,
+    '<=': lambda x, y: x <= y,
+    '>' : lambda x, y: x > y,
+    '>=': lambda x, y: x >= y,
+}
+
+
+class _Unsupported(Exception):
+    """
+    Raised when a where-clause falls outside of the compilable grammar.
+    """
+    pass
+
+
+
+def where_to_mask(dataset, where_clause):
+    """
+    Evaluate a where-clause as a boolean mask over the dataset.
+    Return None if the clause cannot be compiled (the caller should fall back to SQL).
+    """
+    tree = _parse_where(where_clause)
+    if tree is None:
+        return None
+
+    try:
+        mask = _evaluate(tree, dataset)
+    except _Unsupported:
+        return None
+
+    if np.ndim(mask) == 0:
+        mask = np.full(len(dataset), bool(mask))
+
+    return pd.Series(np.asarray(mask, dtype=bool), index=dataset.index)
+
+
+
+###### FUNCTIONS FOR PARSING
+def _tokenize(where_clause):
+    """
+    Split a where-clause into (kind, value) tokens.
+    """
+    tokens = []
+    position = 0
+
+    while position < len(where_clause):
+        match = _TOKEN_REGEX.match(where_clause, position)
+        if not match or match.end() == position:
+            raise _Unsupported(where_clause[position:])
+
+        kind = match.lastgroup
+        value = match.group(kind)
+
+        if kind == 'word' and value.upper() in _KEYWORDS:
+            kind, value = 'keyword', value.upper()
+
+        tokens.append((kind, value))
+        position = match.end()
+
+    return tokens
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_where(where_clause):
+    """
+    Parse the where-clause into a tree of tuples, or None if it falls outside the grammar.
+    Results are cached, since the same clauses are applied over and over in a run.
+    """
+    try:
+        parser = _Parser(_tokenize(where_clause))
+        tree = parser.parse_expr()
+
+        if parser.peek() is not None:
+            raise _Unsupported(parser.peek())
+
+        return tree
+
+    except _Unsupported:
+        return None
+
+
+class _Parser:
+    """
+    Recursive-descent parser over the tokens of a where-clause.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return None
+
+    def accept(self, kind, value=None):
+        token = self.peek()
+        if token is not None and token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return token
+        return None
+
+    def expect(self, kind, value=None):
+        token = self.accept(kind, value)
+        if token is None:
+            raise _Unsupported(self.peek())
+        return token
+
+
+    def parse_expr(self):
+        conjuncts = [self.parse_conjunct()]
+        while self.accept('keyword', 'OR'):
+            conjuncts.append(self.parse_conjunct())
+
+        return conjuncts[0] if len(conjuncts) == 1 else ('or', conjuncts)
+
+    def parse_conjunct(self):
+        predicates = [self.parse_predicate()]
+        while self.accept('keyword', 'AND'):
+            predicates.append(self.parse_predicate())
+
+        return predicates[0] if len(predicates) == 1 else ('and', predicates)
+
+    def parse_predicate(self):
+        if self.accept('op', '('):
+            expr = self.parse_expr()
+            self.expect('op', ')')
+            return expr
+
+        if self.accept('keyword', 'TRUE'):
+            return ('const', True)
+        if self.accept('keyword', 'FALSE'):
+            return ('const', False)
+
+        operand = self.parse_operand()
+
+        # IS [NOT] (TRUE | FALSE | NULL)
+        if self.accept('keyword', 'IS'):
+            negate = bool(self.accept('keyword', 'NOT'))
+            value = self.expect('keyword')[1]
+            if value not in ('TRUE', 'FALSE', 'NULL'):
+                raise _Unsupported(value)
+            return ('is', operand, value, negate)
+
+        # Comparisons
+        token = self.peek()
+        if token is not None and token[0] == 'op' and token[1] in _COMPARISONS:
+            self.position += 1
+            return ('cmp', token[1], operand, self.parse_operand())
+
+        # [NOT] BETWEEN / [NOT] IN
+        negate = bool(self.accept('keyword', 'NOT'))
+
+        if self.accept('keyword', 'BETWEEN'):
+            lower = self.parse_operand()
+            self.expect('keyword', 'AND')
+            upper = self.parse_operand()
+            return ('between', operand, lower, upper, negate)
+
+        if self.accept('keyword', 'IN'):
+            self.expect('op', '(')
+            values = [self.parse_operand()]
+            while self.accept('op', ','):
+                values.append(self.parse_operand())
+            self.expect('op', ')')
+            return ('in', operand, values, negate)
+
+        if negate:
+            raise _Unsupported('NOT')
+
+        # A bare column is tested for truthiness.
+        return ('truthy', operand)
+
+    def parse_operand(self):
+        token = self.peek()
+        if token is None:
+            raise _Unsupported(None)
+
+        kind, value = token
+        self.position += 1
+
+        if kind == 'number':
+            return ('lit', float(value) if '.' in value else int(value))
+        if kind == 'string':
+            return ('lit', value[1:-1].replace("''", "'"))
+        if kind == 'quoted':
+            # SQLite treats a double-quoted string as a column if one exists, and a literal otherwise.
+            return ('quoted', value[1:-1].replace('""', '"'))
+        if kind == 'word':
+            return ('col', value)
+        if kind == 'keyword' and value in ('TRUE', 'FALSE'):
+            return ('lit', int(value == 'TRUE'))
+
+        raise _Unsupported(value)
+
+
+
+###### FUNCTIONS FOR EVALUATION
+def _evaluate(tree, dataset):
+    """
+    Evaluate a parsed where-clause into a boolean mask (or a scalar bool).
+    """
+    kind = tree[0]
+
+    if kind == 'const':
+        return tree[1]
+
+    if kind == 'and':
+        return functools.reduce(np.logical_and, (_evaluate(x, dataset) for x in tree[1]))
+
+    if kind == 'or':
+        return functools.reduce(np.logical_or, (_evaluate(x, dataset) for x in tree[1]))
+
+    if kind == 'truthy':
+        return _truthy(_resolve_column(tree[1], dataset))
+
+    if kind == 'is':
+        _, operand, value, negate = tree
+        column = _resolve_column(operand, dataset)
+
+        if value == 'NULL':
+            mask = column.isna().to_numpy()
+        elif value == 'TRUE':
+            mask = _truthy(column)
+        else:
+            mask = column.notna().to_numpy() & ~_truthy(column)
+
+        return ~mask if negate else mask
+
+    if kind == 'cmp':
+        _, op, left, right = tree
+        left, right = _resolve_pair(left, right, dataset)
+        return _notna(left) & _notna(right) & _compare(_COMPARISONS[op], left, right)
+
+    if kind == 'between':
+        _, operand, lower, upper, negate = tree
+        column, lower = _resolve_pair(operand, lower, dataset)
+        column, upper = _resolve_pair(operand, upper, dataset)
+
+        mask = _compare(np.greater_equal, column, lower) & _compare(np.less_equal, column, upper)
+        return _notna(column) & (~mask if negate else mask)
+
+    if kind == 'in':
+        _, operand, values, negate = tree
+        column = _resolve_column(operand, dataset)
+        values = [_resolve_pair(operand, value, dataset)[1] for value in values]
+
+        if any(isinstance(value, pd.Series) for value in values):
+            raise _Unsupported('IN over columns')
+
+        mask = column.isin(values).to_numpy()
+        return _notna(column) & (~mask if negate else mask)
+
+    raise _Unsupported(kind)
+
+
+def _resolve_column(operand, dataset):
+    """
+    Return the column referenced by the operand, or raise if it is not a column of the dataset.
+    """
+    kind, value = operand
+
+    if kind in ('col', 'quoted') and value in dataset.columns:
+        column = dataset[value]
+        if isinstance(column, pd.DataFrame):  # Duplicate column names
+            raise _Unsupported(value)
+        return column
+
+    raise _Unsupported(value)
+
+
+def _resolve_pair(left, right, dataset):
+    """
+    Resolve two operands of a comparison, verifying that their types are compatible.
+    """
+    resolved = []
+
+    for operand in (left, right):
+        kind, value = operand
+
+        if kind == 'lit':
+            resolved.append(value)
+        elif kind == 'quoted' and value not in dataset.columns:
+            resolved.append(value)
+        else:
+            resolved.append(_resolve_column(operand, dataset))
+
+    if not all(isinstance(x, pd.Series) for x in resolved):
+        _check_comparable(*resolved)
+
+    return resolved
+
+
+def _check_comparable(left, right):
+    """
+    Only compare like with like; SQL type-affinity rules are left to the SQL fallback.
+    """
+    for column, value in ((left, right), (right, left)):
+        if not isinstance(column, pd.Series) or isinstance(value, pd.Series):
+            continue
+
+        if isinstance(value, str):
+            if pd.api.types.infer_dtype(column, skipna=True) not in ('string', 'empty'):
+                raise _Unsupported(value)
+        else:
+            if not pd.api.types.is_numeric_dtype(column):
+                raise _Unsupported(value)
+
+
+def _truthy(column):
+    """
+    SQL truthiness of a boolean or numeric column, with nulls evaluated as False.
+    """
+    if pd.api.types.is_bool_dtype(column) or pd.api.types.is_numeric_dtype(column):
+        return (column.notna() & (column.fillna(0) != 0)).to_numpy(dtype=bool)
+
+    raise _Unsupported(column.name)
+
+
+def _compare(comparison, left, right):
+    """
+    Apply a comparison, evaluating nulls as False.
+    """
+    try:
+        result = comparison(left, right)
+    except TypeError:
+        raise _Unsupported(comparison)
+
+    if isinstance(result, pd.Series):
+        return result.fillna(False).to_numpy(dtype=bool)
+    return np.asarray(result, dtype=bool)
+
+
+def _notna(value):
+    if isinstance(value, pd.Series):
+        return value.notna().to_numpy()
+    return value is not None
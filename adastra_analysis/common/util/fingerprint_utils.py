@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+
+
+def hash_file(path):
+    """
+    Hash the contents of a file on disk.
+    """
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def build_fingerprint(config, upstream=None, sources=None, version=None, engine=None):
+    """
+    Hash everything that determines an output: its resolved config, the fingerprints of the datasets
+    it reads from, the contents of any source files it reads directly, the version of the code that builds it,
+    and the query engine backend that read its datasets (if any).
+
+    The config's `performance_settings` only change how an output is made (e.g. how many processes), so they are left out.
+    """
+    excluded = {'result', *getattr(config, 'performance_settings', ())}
+
+    payload = {
+        'type'    : type(config).__name__,
+        'config'  : {key: value for key, value in vars(config).items() if key not in excluded},
+        'upstream': upstream or {},
+        'sources' : {path: hash_file(path) for path in sources or []},
+        'version' : version,
+    }
+
+    # Only outputs read through the query engine depend on it.
+    if engine is not None:
+        payload['engine'] = engine
+
+    payload = json.dumps(payload, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+
+###### FUNCTIONS FOR SIDECAR MANIFESTS
+def get_manifest_path(output, kind='manifest', extension='json'):
+    """
+    The manifest sits next to its output: `dir/name.jsonl` -> `dir/.name.jsonl.manifest.json`.
+    """
+    directory, basename = os.path.split(os.path.normpath(output))
+    return os.path.join(directory, f".{basename}.{kind}.{extension}")
+
+
+def _stat_output(output):
+    """
+    Size and modification time of an output file, used to notice outputs changed outside of a build.
+    (Folders are only checked for existence.)
+    """
+    if not os.path.isfile(output):
+        return None
+
+    stat = os.stat(output)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def write_manifest(output, fingerprint, files=None):
+    """
+    Record the fingerprint an output was generated from.
+    If the output is a set of `files` (e.g. one per partition), the stats of each are recorded instead.
+    """
+    manifest = {
+        'fingerprint': fingerprint,
+        'stat': _stat_output(output),
+    }
+
+    if files is not None:
+        manifest['files'] = {file: _stat_output(file) for file in files}
+
+    manifest_path = get_manifest_path(output)
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+
+    with open(manifest_path, 'w') as fp:
+        json.dump(manifest, fp, indent=2)
+
+
+def read_fingerprint(output):
+    """
+    Return the fingerprint recorded for an output, or None if it is missing or has changed since.
+    """
+    try:
+        with open(get_manifest_path(output), 'r') as fp:
+            manifest = json.load(fp)
+
+    except (OSError, ValueError):
+        return None
+
+    if 'files' in manifest:
+        if not all(
+            stat is not None and stat == _stat_output(file) for file, stat in manifest['files'].items()
+        ):
+            return None
+
+    elif not os.path.exists(output) or manifest.get('stat') != _stat_output(output):
+        return None
+
+    return manifest.get('fingerprint')
+
+
+def is_up_to_date(output, fingerprint):
+    """
+    An output can be skipped if it was generated from exactly this fingerprint.
+    """
+    return read_fingerprint(output) == fingerprint
+
+
+def get_output_fingerprint(output):
+    """
+    Identify an existing output for use in downstream fingerprints.
+    Prefer the recorded fingerprint; fall back to hashing the file (e.g. one built before manifests existed).
+    """
+    fingerprint = read_fingerprint(output)
+
+    if fingerprint is None and os.path.isfile(output):
+        fingerprint = hash_file(output)
+
+    return fingerprint
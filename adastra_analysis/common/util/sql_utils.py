@@ -0,0 +1,64 @@
+import re
+
+
+# Strip literals and comments before looking for identifiers, so `where file = 'adastra'` is not a reference.
+_NON_IDENTIFIER_REGEX = re.compile(r"""
+    '(?:[^']|'')*'      # String literals
+  | --[^\n]*            # Line comments
+  | /\*.*?\*/           # Block comments
+""", re.VERBOSE | re.DOTALL)
+
+_IDENTIFIER_REGEX = re.compile(r'"((?:[^"]|"")+)"|`([^`]+)`|\[([^\]]+)\]|([A-Za-z_][A-Za-z_0-9]*)')
+
+# Literals are kept verbatim when normalizing SQL; comments are dropped and whitespace is collapsed.
+_NORMALIZE_REGEX = re.compile(r"""
+    ('(?:[^']|'')*'|"(?:[^"]|"")*")     # String literals and quoted identifiers
+  | (?:\s|--[^\n]*|/\*.*?\*/)+          # Runs of whitespace and comments
+""", re.VERBOSE | re.DOTALL)
+
+# A star directly after `select`, a comma, or a table alias selects every column (unlike `count(*)` or `x * y`).
+_SELECT_ALL_REGEX = re.compile(r'(?:\bselect\s+(?:distinct\s+|all\s+)?|,\s*|\.)\*', re.IGNORECASE)
+
+# A natural join matches on every shared column, none of which are named in the SQL.
+_NATURAL_JOIN_REGEX = re.compile(r'\bnatural\s+(?:(?:left|right|full|inner)\s+)?(?:outer\s+)?join\b', re.IGNORECASE)
+
+
+def get_identifiers(sql):
+    """
+    Collect every identifier-like token in the SQL (table names, column names, keywords, etc.).
+    """
+    sql = _NON_IDENTIFIER_REGEX.sub(' ', sql or '')
+
+    identifiers = set()
+    for match in _IDENTIFIER_REGEX.finditer(sql):
+        identifier = next(group for group in match.groups() if group is not None)
+        identifiers.add(identifier.replace('""', '"'))
+
+    return identifiers
+
+
+def selects_all(sql):
+    """
+    Check whether the SQL needs every column of a table (`select *`, `alias.*`, or a `natural join`).
+    """
+    sql = _NON_IDENTIFIER_REGEX.sub(' ', sql or '')
+    return bool(_SELECT_ALL_REGEX.search(sql) or _NATURAL_JOIN_REGEX.search(sql))
+
+
+def get_referenced_tables(sql, names):
+    """
+    Return the subset of dataset `names` referenced in the SQL.
+
+    This is deliberately loose: a column that shares a dataset's name also counts as a reference.
+    Over-including only adds an unnecessary dependency; missing one would break a query.
+    """
+    return get_identifiers(sql) & set(names)
+
+
+def normalize_sql(sql):
+    """
+    Reduce the SQL to a canonical form, so the same query indented or commented differently compares equal.
+    """
+    return _NORMALIZE_REGEX.sub(
+        lambda match: match.group(1) or ' ', sql or ''
+    ).strip()
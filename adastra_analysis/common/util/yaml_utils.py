@@ -1,13 +1,19 @@
+import importlib
 import os
 import yaml
 
-from adastra_analysis.common.dataset import Dataset
-from adastra_analysis.adastra.adastra_dataset import AdastraDataset
 
-from adastra_analysis.runs.query import Query
-from adastra_analysis.runs.relplot import Relplot
-from adastra_analysis.runs.screenplay import Screenplay
-from adastra_analysis.runs.wordcloud import Wordcloud
+# Run-process classes by YAML tag, as (module, class).
+# Each is only imported once its tag is found in the configs.
+RUN_CONSTRUCTORS = {
+    '!Dataset'       : ('adastra_analysis.common.dataset'          , 'Dataset'       ),
+    '!AdastraDataset': ('adastra_analysis.adastra.adastra_dataset' , 'AdastraDataset'),
+
+    '!Query'         : ('adastra_analysis.runs.query'              , 'Query'         ),
+    '!Relplot'       : ('adastra_analysis.runs.relplot'            , 'Relplot'       ),
+    '!Screenplay'    : ('adastra_analysis.runs.screenplay'         , 'Screenplay'    ),
+    '!Wordcloud'     : ('adastra_analysis.runs.wordcloud'          , 'Wordcloud'     ),
+}
 
 
 
@@ -34,6 +40,17 @@ def _or_join(loader, node):
     )
 
 
+def _lazy_constructor(module_name, class_name):
+    """
+    Defer importing a run-process class until a node with its tag is constructed.
+    """
+    def _constructor(loader, node):
+        cls = getattr(importlib.import_module(module_name), class_name)
+        return cls.yaml_constructor(loader, node)
+
+    return _constructor
+
+
 def get_extended_yaml_loader():
     """
     Extend `yaml.SafeLoader` with additional constructors.
@@ -46,13 +63,8 @@ def get_extended_yaml_loader():
     loader.add_constructor('!OR', _or_join)
 
     # Run-process constructors
-    loader.add_constructor('!Dataset', Dataset.yaml_constructor)
-    loader.add_constructor('!AdastraDataset', AdastraDataset.yaml_constructor)
-    
-    loader.add_constructor('!Query'     , Query.yaml_constructor)
-    loader.add_constructor('!Relplot'   , Relplot.yaml_constructor)
-    loader.add_constructor('!Screenplay', Screenplay.yaml_constructor)
-    loader.add_constructor('!Wordcloud' , Wordcloud.yaml_constructor)
+    for tag, (module_name, class_name) in RUN_CONSTRUCTORS.items():
+        loader.add_constructor(tag, _lazy_constructor(module_name, class_name))
     
     return loader
 
@@ -12,23 +12,33 @@ class Query(Run):
         name,
         file,
         dataset,
+        partition_by=None,
     ):
 
         self.name = name
         self.file = file
         self.dataset = dataset
+        self.partition_by = partition_by
 
 
-    def build(self, datasets):
+    def build(self, datasets, engine=None):
         """
         
         """
-        return Dataset(**self.dataset).build_dataset(datasets=datasets)
+        return Dataset(**self.dataset).build_dataset(datasets=datasets, engine=engine)
 
 
     def save(self, result):
         """
-        
+        Write the result out, or one file per partition if `partition_by` is specified.
         """
-        self.prepare_directories(self.file)
-        Dataset.save(result, self.file)
+        files = []
+
+        for values, data in self.get_partitions(result):
+            file = self.format_partition(self.file, values)
+
+            self.prepare_directories(file)
+            Dataset.save(data, file)
+            files.append(file)
+
+        return files
@@ -21,6 +21,7 @@ class Relplot(Run):
         title=None,
         axhline=None,
         remove_outliers=False,
+        partition_by=None,
     ):
         self.name = name
         self.file = file
@@ -32,38 +33,47 @@ class Relplot(Run):
         self.title = title
         self.axhline = axhline
         self.remove_outliers = remove_outliers
+        self.partition_by = partition_by
 
 
-    def build(self, datasets):
+    def build(self, datasets, engine=None):
         """
-        Standardized method to build a Seaborn relplot.
+        Standardized method to build the data of a Seaborn relplot.
         """
-        _data = Dataset(**self.dataset).build_dataset(datasets=datasets)
+        return Dataset(**self.dataset).build_dataset(datasets=datasets, engine=engine)
 
-        # Remove outliers if option marked.
-        if self.remove_outliers:
-            y_col = self.relplot_args['y']
-            _data = relplot_utils.remove_outliers(_data, y_col)
 
-        # Establish and build the figure.
-        fig = relplot_utils.build_seaborn_relplot(
-            data=_data,
-            relplot_args=self.relplot_args,
-            figsize=self.figsize,
-            title=self.title,
-            style=self.style,
-            axhline=self.axhline,
-        )
+    def get_renders(self, result):
+        """
+        Yield the keyword arguments to render each figure of the relplot (one per partition, whose values fill the title).
+        These are rendered in this process by `save`, or in worker processes with `--jobs`.
+        """
+        for values, data in self.get_partitions(result):
+
+            # Remove outliers if option marked.
+            if self.remove_outliers:
+                y_col = self.relplot_args['y']
+                data = relplot_utils.remove_outliers(data, y_col)
 
-        return fig
+            yield {
+                'data'        : data,
+                'file'        : self.format_partition(self.file, values),
+                'relplot_args': self.relplot_args,
+                'figsize'     : self.figsize,
+                'title'       : self.format_partition(self.title, values),
+                'style'       : self.style,
+                'axhline'     : self.axhline,
+            }
 
 
     def save(self, result):
         """
-        Write the plot out as a PNG file.
+        Draw the plot and write it out as a PNG file (one per partition).
         """
-        self.prepare_directories(self.file)
-        result.savefig(self.file, bbox_inches='tight')
-    
-        # Reset the environment (Pyplot is memory-hungry).
-        relplot_utils.reset_pyplot()
+        files = []
+
+        for render in self.get_renders(result):
+            self.prepare_directories(render['file'])
+            files.append(relplot_utils.render_relplot(**render))
+
+        return files
@@ -1,5 +1,8 @@
+import contextlib
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 from adastra_analysis.common.dataset import Dataset
 from adastra_analysis.common.run import Run
 
@@ -10,6 +13,9 @@ class Screenplay(Run):
     """
 ​
     """
+    # Threads and chunking only change how the files are written.
+    performance_settings = ('jobs', 'chunk_size')
+
     def __init__(
         self,
 
@@ -23,6 +29,8 @@ class Screenplay(Run):
         screenplay_col,
         contexts,
 
+        jobs = 1,
+        chunk_size = None,
     ):
         self.name = name
         self.folder = folder
@@ -34,25 +42,49 @@ class Screenplay(Run):
         self.screenplay_col = screenplay_col
         self.contexts = contexts
 
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+
 
-    def build(self, datasets):
+    def build(self, datasets, engine=None):
         """
         
         """
-        _data = Dataset(**self.dataset).build_dataset(datasets=datasets)
+        _data = Dataset(**self.dataset).build_dataset(datasets=datasets, engine=engine)
+        return self.format_lines(_data)
+
+
+    def format_lines(self, data):
+        """
+        Format each line by the last context it matches.
+        """
+        return screenplay_utils.apply_screenplay_contexts(
+            data,
+            self.contexts,
+            screenplay_col=self.screenplay_col,
+            justify=self.justify,
+        )
 
 
-        # For each format, subset the dataframe and format each line.
-        for context_config in self.contexts:
+    def run(self, datasets, engine=None):
+        """
+        With `chunk_size` specified, the screenplay is queried, formatted, and written in chunks instead of all at once.
+        """
+        if not self.chunk_size:
+            return super().run(datasets, engine=engine)
 
-            _data = screenplay_utils.apply_screenplay_context(
-                _data,
-                context_config,
-                screenplay_col=self.screenplay_col,
-                justify=self.justify,
-            )
+        chunks = Dataset(**self.dataset).build_chunks(datasets, chunk_size=self.chunk_size, engine=engine)
 
-        return _data
+        # Close the chunks even if writing fails, since the query engine is held until they are.
+        with contextlib.closing(chunks):
+            return self.stream(chunks)
+
+
+    def get_output(self):
+        """
+        Screenplays are written to a folder, which their manifest is kept for.
+        """
+        return self.folder
 
 
     def save(self, result):
@@ -62,17 +94,77 @@ class Screenplay(Run):
         
         `file_col` determines how to divide the files.
         (i.e. `file` for acts, `speaker` for monologues, etc.)
+        Lines are split into files in a single pass, and written in `jobs` threads if specified.
+        """
+        # Group the lines by file name, keeping their order within each file.
+        file_lines = result.groupby(self.file_col, sort=False)[self.screenplay_col]
+
+        if self.jobs > 1:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [executor.submit(self.write_file, file, lines) for file, lines in file_lines]
+                return [future.result() for future in futures]
+
+        return [self.write_file(file, lines) for file, lines in file_lines]
+
+
+    def stream(self, chunks):
         """
-        # Iterate the file names and output each as a separate file.
-        for file in result[self.file_col].unique():
-            where = f'{self.file_col} = "{file}"'
-
-            file_data = Dataset.filter_where(result, where)
-            file_lines = file_data[self.screenplay_col].tolist()
-
-            file_path = os.path.join(self.folder, file + '.txt')
-            self.prepare_directories(file_path)
-            with open(file_path, 'w') as fp:
-                fp.write(
-                    self.line_sep.join(file_lines)
-                )
+        Format and write the screenplay a chunk of lines at a time, appending each chunk to the files it belongs to.
+        Neither the queried nor the formatted screenplay is held in memory as a whole.
+
+        Rows should be ordered by `file_col` (e.g. `order by file, line_idx`), so each file is written in one go.
+        Otherwise, a file is reopened and appended to whenever its lines come up again.
+        (Context where-clauses are evaluated within each chunk, so they should only reference the row itself.)
+        """
+        files = {}
+        fp = None
+        current = None
+
+        try:
+            for chunk in chunks:
+                chunk = self.format_lines(chunk.reset_index(drop=True))
+
+                for file, lines in chunk.groupby(self.file_col, sort=False)[self.screenplay_col]:
+
+                    # Files continue across chunks; open the next only once the last has ended.
+                    if file == current:
+                        fp.write(self.line_sep)
+
+                    else:
+                        if fp is not None:
+                            fp.close()
+
+                        # A file whose lines come up again is appended to.
+                        if file in files:
+                            fp = open(files[file], 'a')
+                            fp.write(self.line_sep)
+
+                        else:
+                            files[file] = os.path.join(self.folder, f"{file}.txt")
+                            self.prepare_directories(files[file])
+                            fp = open(files[file], 'w')
+
+                        current = file
+
+                    fp.write(self.line_sep.join(lines))
+
+        finally:
+            if fp is not None:
+                fp.close()
+
+        return list(files.values())
+
+
+    def write_file(self, file, lines):
+        """
+        Output the lines of a single file, joined by `line_sep`.
+        """
+        file_path = os.path.join(self.folder, f"{file}.txt")
+        self.prepare_directories(file_path)
+
+        with open(file_path, 'w') as fp:
+            fp.write(
+                self.line_sep.join(lines)
+            )
+
+        return file_path
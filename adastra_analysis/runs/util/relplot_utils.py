@@ -1,15 +1,19 @@
-import gc
+import threading
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-from scipy import stats
+# Matplotlib, Seaborn, and SciPy are slow to import, so they are only imported once a relplot is drawn.
+
+
+# Seaborn draws through Pyplot and a global theme, so only one relplot may be drawn at a time in each process.
+PYPLOT_LOCK = threading.Lock()
 
 
 def remove_outliers(data, col, sigma=3):
     """
     
     """
+    from scipy import stats
+
     return data[
         (np.abs(stats.zscore(data[col])) < sigma)
     ]
@@ -24,32 +28,66 @@ def build_seaborn_relplot(
     axhline,
 ):
     """
-    
+    Draw the relplot onto its own figure, drawn on an Agg canvas and untracked by Pyplot.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
     # Set the style if specified (defaults to 'darkgrid' such that Cassius can be seen).
     sns.set_theme(style=style)
 
     # Establish and build the figure.
-    plt.figure()
-    sns.relplot(data=data, **relplot_args)
+    grid = sns.relplot(data=data, **relplot_args)
+    fig = grid.figure
+
+    # Seaborn creates the figure through Pyplot; close it there so it is freed along with the figure object.
+    plt.close(fig)
+    FigureCanvasAgg(fig)
+
+    # The title and line go on the last axes (the only one, unless faceted).
+    ax = grid.axes.flat[-1]
 
     # Add a title if specified.
-    plt.title(title)
+    ax.set_title(title)
 
     # Add a custom horizontal line if specified.
     if axhline:
-        plt.axhline(axhline, linestyle='--', color='black', alpha=0.5)
+        ax.axhline(axhline, linestyle='--', color='black', alpha=0.5)
 
     # Set the output size and return.
-    fig = plt.gcf()
     fig.set_size_inches(*figsize)
 
     return fig
 
 
-def reset_pyplot():
+def render_relplot(
+    data,
+    file,
+    relplot_args,
+    figsize,
+    title,
+    style,
+    axhline,
+):
     """
-    
+    Draw the relplot and write it out as a PNG file, returning the file.
+    This runs in a worker process when relplots are rendered in parallel.
     """
-    plt.close('all')
-    gc.collect()
\ No newline at end of file
+    # The Seaborn theme is still set globally, so draws in the same process take turns.
+    with PYPLOT_LOCK:
+        fig = build_seaborn_relplot(
+            data=data,
+            relplot_args=relplot_args,
+            figsize=figsize,
+            title=title,
+            style=style,
+            axhline=axhline,
+        )
+
+        fig.savefig(file, bbox_inches='tight')
+
+    # Release the figure's artists now; it was already closed in Pyplot, so nothing else holds on to it.
+    fig.clear()
+
+    return file
@@ -1,5 +1,8 @@
+import functools
 import textwrap
 
+import numpy as np
+
 from dataclasses import dataclass
 
 from adastra_analysis.common.dataset import Dataset
@@ -35,51 +38,103 @@ class ScreenplayArgs:
 
 
 
-def apply_screenplay_context(data, context_config, screenplay_col, justify):
+def apply_screenplay_contexts(data, context_configs, screenplay_col, justify):
     """
-    
+    Format the lines of the screenplay by context, in a single pass.
+
+    Every context's where-clause is evaluated up front, and each row is formatted by the last context it matches.
+    A context that reads the screenplay column builds on the formatting of the row's previous matching context.
+    Rows are formatted only by the contexts that reach the final output, and written into the screenplay column by position.
     """
-    context = Context(**context_config)
-            
-    # Subset the screenplay dataset and format those lines.
-    _screenplay_subset = Dataset.filter_where(data, context.where)
-    
-    # Perform transformations on the lines, based on the config logic provided.
-    _screenplay_subset[screenplay_col] = _screenplay_subset.apply(
-        lambda row: _build_formatted_line(
-            row,
-            context.columns,
-            style=context.style,
-            justify=context.justify or justify,
-            textwrap_offset=context.textwrap_offset,
-            add_bar=context.add_bar,
-        ),
-        axis=1
-    )
+    contexts = [Context(**context_config) for context_config in context_configs]
 
-    # Update the original dataset with those changes.
-    # I'd prefer a cleaner method for this, but I'm not familiar enough with Pandas.
-    col_x = f'{screenplay_col}_x'
-    col_y = f'{screenplay_col}_y'
+    masks = [Dataset.where_mask(data, context.where).to_numpy(dtype=bool) for context in contexts]
 
-    merged = data.merge(
-        _screenplay_subset[['file', 'line_idx', screenplay_col]],
-        how='left',
-        on=['file', 'line_idx'],
-    )
-    merged[screenplay_col] = (
-        merged[col_y]
-            .fillna(merged[col_x])
-    )
-    data = merged.drop([col_x, col_y], axis=1)
-    
-    print(f"* `{context.name}` logic applied.", flush=True, end='\r')
-    return data
+    # Walk back from the last context to find the rows each context must format.
+    # A row's screenplay text is pending until a context that does not read it overwrites it.
+    pending = np.ones(len(data), dtype=bool)
+    positions = [None] * len(contexts)
+
+    for idx in reversed(range(len(contexts))):
+        applied = masks[idx] & pending
+        positions[idx] = np.flatnonzero(applied)
+
+        if not any(column['name'] == screenplay_col for column in contexts[idx].columns):
+            pending &= ~applied
+
+    screenplay = data[screenplay_col].to_numpy(dtype=object, copy=True)
+
+    for context, context_positions in zip(contexts, positions):
+
+        # Perform transformations on the lines, based on the config logic provided.
+        if len(context_positions):
+            subset = data.iloc[context_positions].assign(**{screenplay_col: screenplay[context_positions]})
+
+            formatter = compile_formatter(context, justify=justify)
+            screenplay[context_positions] = formatter(subset)
+
+        print(f"* `{context.name}` logic applied.", flush=True, end='\r')
+
+    # Return a new frame: `data` may share its arrays with a memoized query result, which assigning a column can write into.
+    return data.assign(**{screenplay_col: screenplay})
+
+
+
+
+def compile_formatter(context, justify=None):
+    """
+    Compile the columns and style of a context into a formatter, so the config logic is parsed once per context
+    instead of once per row. The formatter takes a dataframe and returns its formatted lines, in order.
+    """
+    justify = context.justify or justify
+    textwrap_offset = context.textwrap_offset
+
+    # Build the transformation of each part of the line up front.
+    line_parts = {}
+
+    for config in context.columns:
+        column_config = ColumnConfigs(**config)
+        line_parts[column_config.name] = _compile_line_part(column_config.screenplay_args)
+
+    # Add a bar if specified.
+    if context.add_bar:
+        bar = '-' * (justify or 10) + '\n'
+    else:
+        bar = ''
+
+    names = list(line_parts.keys())
+
+    def formatter(data):
+        columns = [
+            [format_part(value) for value in data[name]]
+            for name, format_part in line_parts.items()
+        ]
+        rows = zip(*columns) if columns else [()] * len(data)
+
+        formatted_lines = []
+
+        for values in rows:
 
+            # Combine the format strings into the style.
+            formatted_line = context.style.format(**dict(zip(names, values)))
 
+            # Apply textwrap justify to the formatted_line.
+            if justify:
+                formatted_line = _justify_text(
+                    formatted_line,
+                    justify,
+                    textwrap_offset=textwrap_offset,
+                )
 
+            formatted_lines.append(bar + formatted_line)
 
-# Internal helper methods for `build_formatted_line`.
+        return formatted_lines
+
+    return formatter
+
+
+
+# Internal helper methods for `compile_formatter`.
 def _textwrap_wrap(string, justify):
     """
     Custom instantiation of textwrap.wrap() to account for new lines in string.
@@ -87,53 +142,72 @@ def _textwrap_wrap(string, justify):
     output = []
 
     for line in string.splitlines():
-        justified = textwrap.wrap(
-            line, justify,
-            break_long_words=False, replace_whitespace=False
-        )
 
+        # A printable line that already fits is left as-is by textwrap, save for trailing whitespace.
+        if len(line) <= justify and line.isprintable() and line.strip():
+            output.append(line.rstrip())
+            continue
+
+        justified = _get_text_wrapper(justify).wrap(line)
         output.extend(justified)
 
     return output
 
 
-def _format_line_part(line_part, configs):
-        """
-        Format a part of a line with using custom parameters.
-        """
-        screenplay_args = ScreenplayArgs(**configs)
+@functools.lru_cache(maxsize=None)
+def _get_text_wrapper(justify):
+    return textwrap.TextWrapper(
+        justify,
+        break_long_words=False, replace_whitespace=False
+    )
+
+
+def _compile_line_part(configs):
+    """
+    Build a function that formats a part of a line using custom parameters.
+    Only the transformations specified are applied.
+    """
+    screenplay_args = ScreenplayArgs(**configs)
+
+    transforms = []
+
+    # Strip quotes if specified.
+    if screenplay_args.strip_quotes:
+        transforms.append(lambda text: text.strip('"'))
 
-        formatted = line_part
+    # Complete text casing first.
+    if screenplay_args.upper:
+        transforms.append(lambda text: text.upper())
+    if screenplay_args.lower:
+        transforms.append(lambda text: text.lower())
+    if screenplay_args.title:
+        transforms.append(lambda text: text.title())
 
-        # Strip quotes if specified.
-        if screenplay_args.strip_quotes:
-            formatted = formatted.strip('"')
+    # Apply prefixes, postfixes, and whitespace offsetting together.
+    leading = (' ' * (screenplay_args.offset or 0)) + (screenplay_args.prefix or '')
+    trailing = screenplay_args.postfix or ''
 
-        # Complete text casing first.
-        if screenplay_args.upper:
-            formatted = formatted.upper()
-        if screenplay_args.lower:
-            formatted = formatted.lower()
-        if screenplay_args.title:
-            formatted = formatted.title()
+    if leading or trailing:
+        transforms.append(lambda text: leading + text + trailing)
 
-        # Apply prefixes or postfixes if specified.
-        if screenplay_args.prefix:
-            formatted = screenplay_args.prefix + formatted
-        if screenplay_args.postfix:
-            formatted = formatted + screenplay_args.postfix
+    if not transforms:
+        return lambda text: text
 
-        # Apply whitespace offsetting.
-        if screenplay_args.offset:
-            formatted = (' ' * screenplay_args.offset) + formatted
+    if len(transforms) == 1:
+        return transforms[0]
 
-        return formatted
+    def format_part(text):
+        for transform in transforms:
+            text = transform(text)
+        return text
+
+    return format_part
 
 
 def _justify_text(text, justify, textwrap_offset=0):
     """
     Justify the text to a given size, accouting for custom offset on wrapped lines.
-    """        
+    """
     # Apply inital justification.
     justified_lines = _textwrap_wrap(
         text,
@@ -168,54 +242,3 @@ def _justify_text(text, justify, textwrap_offset=0):
     
     # Join the lines into a single string value.
     return '\n'.join(justified_lines)
-
-
-
-# Main method applied across rows in the dataset.
-def _build_formatted_line(
-    row,
-    column_configs,
-    style,
-    justify=None,
-    textwrap_offset=0,
-    add_bar=False,
-):
-    """
-    Full logic for converting a single row into a formatted line.
-    """
-    line_parts = {}
-
-    # Apply the config logic to each part of the line.
-    for config in column_configs:
-        column_config = ColumnConfigs(**config)
-        
-        # Extract the line part text from the row.
-        column = row[column_config.name]
-
-        # Complete each line part configs, defaulting to no formatting if unspecified.
-        formatted = _format_line_part(column, column_config.screenplay_args)
-
-        # Add the transformed line part back to the dictionary.
-        line_parts[column_config.name] = formatted
-
-    # Combine the format strings into the style.
-    formatted_line = style.format(**line_parts)
-
-    # Apply textwrap justify to the formatted_line.
-    if justify:
-        formatted_line = _justify_text(
-            formatted_line,
-            justify,
-            textwrap_offset=textwrap_offset,
-        )
-
-    # Add a bar if specified.
-    if add_bar:
-        if justify:
-            bar = '-' * justify
-        else:
-            bar = '-' * 10
-        
-        formatted_line = bar + '\n' + formatted_line
-
-    return formatted_line
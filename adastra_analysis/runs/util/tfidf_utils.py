@@ -1,22 +1,57 @@
+import threading
+
 import numpy as np
 import pandas as pd
 
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.preprocessing import normalize
+from dataclasses import dataclass
 
 from adastra_analysis.common.dataset import Dataset
 
 
+# Scikit-learn and SciPy are slow to import, so they are only imported once term-freqs are built.
+
+
 # JK:: Build another method to just SUM precomputed TF-IDF values.
 # Compare to the output of the method below.
 # How similar are they?
 
 
+# Term frequencies shared by every wordcloud built from the same corpus in a run.
+# Keyed by the dataset config, documents column, CountVectorizer args, and the input datasets.
+_SHARED_TERM_FREQS = {}
+_SHARED_TERM_FREQS_LOCK = threading.Lock()
+
+
+def _freeze(value):
+    """
+    Convert nested configs into a hashable key.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(val)) for key, val in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(val) for val in value)
+    return value
+
+
+@dataclass
+class TermFreqs:
+    """
+    Sparse term-freqs of a corpus, with the row metadata kept in a separate lightweight frame.
+    """
+    index: pd.DataFrame           # One row of metadata per document (every non-document column).
+    matrix: 'sparse.csr_matrix'   # Documents x vocabulary counts.
+    features: np.ndarray          # Vocabulary, in column order of `matrix`.
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+
+
 def _get_doc_freqs(term_freqs):
     """
-    Convert a dataframe of term-freqs of tokens by line into doc-freq counts.
+    Convert a sparse matrix of term-freqs of tokens by line into doc-freq counts.
     """
-    return np.array( term_freqs.astype(bool).sum() )
+    return term_freqs.matrix.getnnz(axis=0).astype(np.int64)
 
 
 
@@ -27,33 +62,60 @@ def get_term_freqs(data, doc_col, countvectorizer_args):
     The searchable index and documents column are arguments.
     Use user-provided TFIDF-arguments (none hard-coded).
     """
-    index = list(data.columns)
-    index.remove(doc_col)
+    # Keep every other column as searchable metadata, aligned by position with the matrix rows.
+    index = data.drop(columns=[doc_col]).reset_index(drop=True)
 
-    # Build out the list of documents to feed to the vectorizer.
-    documents = (
-        data.copy()
-            .reset_index()
-            .set_index(index)
-            [doc_col]
-    )
+    from scipy import sparse
+    from sklearn.feature_extraction.text import CountVectorizer
 
     # Establish the CountVectorizer with the user-provided arguments.
     vectorizer = CountVectorizer(**countvectorizer_args)
 
-    # Get the term frequencies and document frequencies.
-    X = vectorizer.fit_transform(documents)
-    features = vectorizer.get_feature_names_out()
-    
-    term_freqs = pd.DataFrame(
-        X.toarray(),
-        columns=features
-    ).set_index(documents.index)
+    # Get the term frequencies (kept sparse to bound memory by the number of tokens, not the vocabulary).
+    X = vectorizer.fit_transform(data[doc_col])
+
+    return TermFreqs(
+        index=index,
+        matrix=sparse.csr_matrix(X),
+        features=vectorizer.get_feature_names_out(),
+    )
+
+
 
-    # term_freqs['_term_frequencies'] = term_freqs[features].agg(lambda x: x.to_json(), axis=1)
-    # term_freqs.drop(columns=features, inplace=True)
+def get_shared_term_freqs(dataset_config, datasets, doc_col, countvectorizer_args, engine=None):
+    """
+    Build the dataset and fit its term-freqs once per distinct corpus, reusing them across wordclouds.
+    Only the filter and IDF steps differ between wordclouds built from the same corpus.
+    """
+    # Only the datasets the corpus is built from belong in the key; others may load in the meantime.
+    dataset = Dataset(**dataset_config)
+    dependencies = dataset.get_dependencies(datasets)
+
+    key = (
+        _freeze(dataset_config), doc_col, _freeze(countvectorizer_args),
+        tuple((name, id(datasets[name])) for name in sorted(dependencies)),
+    )
+
+    # Concurrent wordclouds on the same corpus wait for the first one to fit it.
+    with _SHARED_TERM_FREQS_LOCK:
+        if key not in _SHARED_TERM_FREQS:
+            data = dataset.build_dataset(datasets=datasets, engine=engine)
 
-    return term_freqs
+            _SHARED_TERM_FREQS[key] = get_term_freqs(
+                data=data,
+                doc_col=doc_col,
+                countvectorizer_args=countvectorizer_args
+            )
+
+        return _SHARED_TERM_FREQS[key]
+
+
+def clear_shared_term_freqs():
+    """
+    Release the shared term-freqs once all wordclouds are complete.
+    """
+    with _SHARED_TERM_FREQS_LOCK:
+        _SHARED_TERM_FREQS.clear()
 
 
 
@@ -61,31 +123,46 @@ def filter_term_freqs(term_freqs, where):
     """
     Subset term-freqs of a dataframe by specified filters.
     """
-    # Build a new dataset with just the index.
-    index = (
-        term_freqs.index
-            .to_frame(index=False)
-    )
-    index_cols = index.columns
-
-    # Run the user-provided filter on this index.
+    # Run the user-provided filter on the index, tracking the position of each row.
     filtered_index = Dataset.filter_where(
-        index.reset_index(),
+        term_freqs.index.reset_index(),
         where
-    ).set_index('index')
+    )
 
     # Verify the filter hasn't truncated the dataset.
     if filtered_index.empty:
         raise Exception(f"! Filter query `{where}` returned 0 rows!")
 
     # Filter the term freqs to only rows in user-provided filter.
-    filtered_term_freqs = (
-        term_freqs.reset_index()
-            .drop(index_cols, axis=1)
-            .filter(items=filtered_index.index, axis=0)
+    positions = filtered_index['index'].to_numpy()
+
+    return TermFreqs(
+        index=filtered_index.drop(columns=['index']),
+        matrix=term_freqs.matrix[positions],
+        features=term_freqs.features,
     )
 
-    return filtered_term_freqs
+
+def partition_term_freqs(term_freqs, columns):
+    """
+    Split term-freqs by the values of the index columns in a single pass, yielding the values of each group (by column)
+    and its term-freqs. Without columns, the term-freqs are yielded once, with no values.
+    """
+    if not columns:
+        yield {}, term_freqs
+        return
+
+    # A single column is grouped by name, as in `Run.get_partitions`.
+    by = columns[0] if len(columns) == 1 else columns
+
+    for keys, positions in sorted(term_freqs.index.groupby(by).indices.items()):
+        keys = keys if isinstance(keys, tuple) else (keys,)
+
+        yield dict(zip(columns, keys)), TermFreqs(
+            index=term_freqs.index.iloc[positions].reset_index(drop=True),
+            matrix=term_freqs.matrix[positions],
+            features=term_freqs.features,
+        )
 
 
 
@@ -114,23 +191,20 @@ def build_filtered_tfidf_word_freqs(
         / (doc_freqs - filtered_doc_freqs)
     ) + 1
 
-    # Merge them into one TF-IDF and normalize.
-    tfidfs = filtered_term_freqs * filtered_inverse_doc_freqs
-    tfidfs = pd.DataFrame(
-        normalize(tfidfs, norm='l2', axis=1)
+    # Merge them into one TF-IDF and normalize (both stay sparse).
+    from scipy import sparse
+    tfidfs = sparse.csr_matrix(
+        filtered_term_freqs.matrix.multiply(filtered_inverse_doc_freqs)
     )
+    from sklearn.preprocessing import normalize
+    tfidfs = normalize(tfidfs, norm='l2', axis=1)
 
     # Sum into word frequency dicts of words to tfidf.
-    word_frequencies = (
-        pd.DataFrame(tfidfs.sum())
-            .set_index(filtered_term_freqs.columns)
-            .to_dict()
-            [0]
-    )
+    word_frequencies = np.asarray(tfidfs.sum(axis=0)).ravel()
 
     # Filter out zero-count items (to allow word cloud repeat to actually work.)
     word_frequencies = {
-        word: freq for word, freq in word_frequencies.items() if freq > 0 
+        word: freq for word, freq in zip(filtered_term_freqs.features, word_frequencies) if freq > 0 
     }
 
     return word_frequencies
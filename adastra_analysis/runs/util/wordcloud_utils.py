@@ -1,14 +1,15 @@
 import numpy as np
 import pandas as pd
 
-from PIL import Image
-from wordcloud import WordCloud, ImageColorGenerator
+# PIL and WordCloud are only imported once a wordcloud is rendered (often in a worker process).
 
 
 def _get_image_mask(image_path):
     """
     Convert an image on disk to a numpy image mask.
     """
+    from PIL import Image
+
     image = Image.open(image_path)
     image_mask = np.array(image)
     return image_mask
@@ -21,6 +22,8 @@ def word_freqs_to_wordcloud(word_freqs, image, wordcloud_args):
     
     Use a source image as a mask for its design.
     """
+    from wordcloud import WordCloud, ImageColorGenerator
+
     image_mask = _get_image_mask(image)
     height, width, _ = image_mask.shape
     
@@ -36,3 +39,17 @@ def word_freqs_to_wordcloud(word_freqs, image, wordcloud_args):
     wc = wc.recolor(color_func=image_colors)
 
     return wc
+
+
+
+def render_wordcloud(word_freqs, image, wordcloud_args, file):
+    """
+    Build the wordcloud and write it to disk.
+
+    Only plain word-freqs and paths are passed in, so this can run in a worker process.
+    The wordcloud is released as soon as this returns.
+    """
+    wc = word_freqs_to_wordcloud(word_freqs, image=image, wordcloud_args=wordcloud_args)
+    wc.to_file(file)
+
+    return file
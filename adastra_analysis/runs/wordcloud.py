@@ -1,6 +1,6 @@
-import gc
+import glob
+import re
 
-from adastra_analysis.common.dataset import Dataset
 from adastra_analysis.common.run import Run
 
 from adastra_analysis.runs.util import tfidf_utils
@@ -25,6 +25,7 @@ class Wordcloud(Run):
         countvectorizer_args,
         wordcloud_args,
 
+        partition_by=None,
     ):
         self.name = name
         self.file = file
@@ -37,17 +38,21 @@ class Wordcloud(Run):
         self.countvectorizer_args = countvectorizer_args
         self.wordcloud_args = wordcloud_args
 
+        self.partition_by = partition_by
 
-    def build(self, datasets):
+
+    def build(self, datasets, engine=None):
         """
-        
+        Build the TF-IDF word-freqs of the wordcloud (or of each partition, if `partition_by` is specified).
+        Returns a list of (partition values, word-freqs).
         """
-        _data = Dataset(**self.dataset).build_dataset(datasets=datasets)
-
-        _term_freqs = tfidf_utils.get_term_freqs(
-            data=_data.copy(),
+        # Wordclouds built from the same corpus share one fitted set of term-freqs.
+        _term_freqs = tfidf_utils.get_shared_term_freqs(
+            dataset_config=self.dataset,
+            datasets=datasets,
             doc_col=self.documents_col,
-            countvectorizer_args=self.countvectorizer_args
+            countvectorizer_args=self.countvectorizer_args,
+            engine=engine,
         )
 
         # The documents are sourced by a subset of rows in the dataset.
@@ -57,25 +62,48 @@ class Wordcloud(Run):
             where=self.where
         )
         
-        _word_freqs = tfidf_utils.build_filtered_tfidf_word_freqs(
-            _term_freqs, _filtered_term_freqs
-        )
+        # Only the word-freqs are returned, so rendering can be shipped to another process cheaply.
+        return [
+            (values, tfidf_utils.build_filtered_tfidf_word_freqs(_term_freqs, _partition_term_freqs))
+            for values, _partition_term_freqs in tfidf_utils.partition_term_freqs(
+                _filtered_term_freqs, self.get_partition_columns()
+            )
+        ]
         
-        return wordcloud_utils.word_freqs_to_wordcloud(
-            _word_freqs,
-            image=self.image,
-            wordcloud_args=self.wordcloud_args
+
+    def get_sources(self):
+        """
+        A partitioned wordcloud may template its `image`; every image matching the template is a source.
+        """
+        if self.partition_by:
+            return sorted(glob.glob(re.sub(r'\{[^}]*\}', '*', self.image)))
+
+        return [self.image]
+
+
+    def get_renders(self, result):
+        """
+        Pair the word-freqs of each wordcloud with the arguments to render it: one per partition.
+        """
+        return (
+            {
+                'word_freqs': word_freqs,
+                'image': self.format_partition(self.image, values),
+                'wordcloud_args': self.wordcloud_args,
+                'file': self.format_partition(self.file, values),
+            }
+            for values, word_freqs in result
         )
-        
+
 
     def save(self, result):
         """
-        
+        Render the word-freqs into a wordcloud and write it out as a PNG file (one per partition).
         """
-        self.prepare_directories(self.file)
-        result.to_file(self.file)
-        
-        # Reset the wordcloud to prevent memory overflows.
-        result = None
-        gc.collect()
-    
\ No newline at end of file
+        files = []
+
+        for render in self.get_renders(result):
+            self.prepare_directories(render['file'])
+            files.append(wordcloud_utils.render_wordcloud(**render))
+
+        return files
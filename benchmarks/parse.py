@@ -0,0 +1,85 @@
+"""
+Script-parsing benchmark: time building the Adastra dataset from the `.rpy` scripts serially and across worker processes.
+
+Worker processes are spawned, so each one pays for its own imports before parsing anything; this shows how large a corpus
+must be before `jobs > 1` pays off. The scripts are copied `--scale` times over to simulate larger games.
+
+    python benchmarks/parse.py --adastra-dir ADASTRA_DIR [--jobs 1 2 4] [--scale 1 4 16] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, REPO_DIR)
+
+from adastra_analysis.adastra.util import base_utils
+
+
+def copy_scripts(renpy_filepaths, folder, scale):
+    """
+    Copy every script `scale` times into the folder (as `name_0.rpy`, `name_1.rpy`, ...).
+    """
+    copies = []
+
+    for copy_idx in range(scale):
+        for filepath in renpy_filepaths:
+            name = base_utils.get_script_name(filepath)
+            copy_path = os.path.join(folder, f"{name}_{copy_idx}.rpy")
+
+            shutil.copyfile(filepath, copy_path)
+            copies.append(copy_path)
+
+    return copies
+
+
+def best_time(func, repeat):
+    """
+    Return the fastest of `repeat` calls (in seconds) and the result of the last one.
+    """
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--adastra-dir', required=True , type=str)
+    parser.add_argument('--jobs'       , required=False, type=int, nargs='*', default=[1, 2, 4])
+    parser.add_argument('--scale'      , required=False, type=int, nargs='*', default=[1, 4, 16])
+    parser.add_argument('--repeat'     , required=False, type=int, default=3)
+    args = parser.parse_args()
+
+    renpy_filepaths = sorted(glob.glob(os.path.join(args.adastra_dir, 'game', '*.rpy')))
+    if not renpy_filepaths:
+        print(f"! No script files found in `{os.path.join(args.adastra_dir, 'game')}`")
+        sys.exit(1)
+
+    print(f"* {os.cpu_count()} cores; best of {args.repeat} runs:")
+    print(f"  {'scale':>5} {'files':>6} {'lines':>9} " + ' '.join(f"{f'jobs={jobs} s':>10}" for jobs in args.jobs))
+
+    for scale in args.scale:
+        with tempfile.TemporaryDirectory() as folder:
+            copies = copy_scripts(renpy_filepaths, folder, scale)
+
+            timings = []
+            for jobs in args.jobs:
+                timing, data = best_time(
+                    lambda: base_utils.build_adastra_data_from_files(copies, jobs=jobs), args.repeat
+                )
+                timings.append(timing)
+
+        print(f"  {scale:>5} {len(copies):>6} {len(data):>9} " + ' '.join(f"{timing:>10.2f}" for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Screenplay benchmark: time formatting and writing each screenplay in the configs (by default, the three shipped styles).
+
+The datasets are read from their built files, so run `python -m adastra_analysis build` first.
+Each screenplay's source data is queried once; formatting and writing are then timed separately (best of `--repeat`).
+
+    python benchmarks/screenplays.py [--configs adastra_analysis_configs.yaml] [--screenplays NAME ...] [--repeat 5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, REPO_DIR)
+
+from adastra_analysis.common.dataset import Dataset
+from adastra_analysis.common.query_engine import get_query_engine
+from adastra_analysis.common.util import yaml_utils
+
+
+def best_time(func, repeat):
+    """
+    Return the fastest of `repeat` calls (in seconds) and the result of the last one.
+    Progress printed by the screenplay contexts is silenced.
+    """
+    best = float('inf')
+
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def load_datasets(dataset_configs):
+    """
+    Load every built dataset named in the configs.
+    """
+    datasets = {}
+
+    for config in dataset_configs or []:
+        if not os.path.exists(config.file):
+            print(f"! Dataset `{config.name}` has not been built yet: `{config.file}`")
+            sys.exit(1)
+
+        datasets[config.name] = Dataset.load_dataset(config.file)
+
+    return datasets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--configs'    , required=False, type=str, default=os.path.join(REPO_DIR, 'adastra_analysis_configs.yaml'))
+    parser.add_argument('--screenplays', required=False, type=str, nargs='*')
+    parser.add_argument('--repeat'     , required=False, type=int, default=5)
+    args = parser.parse_args()
+
+    yaml_configs = yaml_utils.load_yaml(args.configs)
+    datasets = load_datasets(yaml_configs.get('datasets', {}).get('datasets'))
+    engine = get_query_engine(yaml_configs.get('query_engine', 'sqlite'), cache_size=0)
+
+    screenplays = [
+        screenplay for screenplay in yaml_configs.get('screenplays', {}).get('screenplays') or []
+        if not args.screenplays or screenplay.name in args.screenplays
+    ]
+
+    print(f"* Best of {args.repeat} runs:")
+    print(f"  {'screenplay':<24} {'lines':>8} {'format ms':>10} {'write ms':>10} {'us/line':>8}")
+
+    for screenplay in screenplays:
+        data = Dataset(**screenplay.dataset).build_dataset(datasets=datasets, engine=engine)
+        format_time, result = best_time(lambda: screenplay.format_lines(data), args.repeat)
+
+        # Write into a scratch folder instead of the configured one.
+        with tempfile.TemporaryDirectory() as folder:
+            screenplay.folder = folder
+            write_time, _ = best_time(lambda: screenplay.save(result), args.repeat)
+
+        per_line = (format_time + write_time) / max(len(data), 1) * 1e6
+        print(f"  {screenplay.name:<24} {len(data):>8} {format_time * 1000:>10.1f} {write_time * 1000:>10.1f} {per_line:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Startup benchmark: import the CLI and load a configs file under `python -X importtime`.
+
+Fails if any of the slow optional libraries (plotting, TF-IDF, NLP) are imported before a run needs them,
+or if the total import time exceeds the budget.
+
+    python benchmarks/startup.py [--configs adastra_analysis_configs.yaml] [--budget-ms 1500] [--top 15]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+
+# Each of these takes tens to hundreds of milliseconds to import, and is only needed by some runs.
+DEFERRED_MODULES = [
+    'matplotlib', 'seaborn', 'scipy', 'sklearn', 'wordcloud', 'PIL', 'spacy', 'spacytextblob', 'nltk',
+]
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+STARTUP_CODE = """
+import adastra_analysis.app
+from adastra_analysis.common.adastra_analysis import AdastraAnalysis
+AdastraAnalysis({configs!r})
+"""
+
+# `import time: self [us] | cumulative | imported package`
+IMPORTTIME_REGEX = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure_imports(configs):
+    """
+    Run the startup in a fresh interpreter and collect (module, self_us, cumulative_us, depth) for each import.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE.format(configs=configs)],
+        cwd=REPO_DIR, capture_output=True, text=True,
+        env={**os.environ, 'PYTHONPATH': REPO_DIR},
+    )
+
+    if process.returncode != 0:
+        raise Exception(f"! Startup failed:\n{process.stderr}")
+
+    imports = []
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_REGEX.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--configs'  , required=False, type=str, default=os.path.join(REPO_DIR, 'adastra_analysis_configs.yaml'))
+    parser.add_argument('--budget-ms', required=False, type=float, default=1500)
+    parser.add_argument('--top'      , required=False, type=int, default=15)
+    args = parser.parse_args()
+
+    imports = measure_imports(os.path.abspath(args.configs))
+
+    # Top-level imports (depth 0) add up to the whole startup.
+    total_ms = sum(cumulative for _, _, cumulative, depth in imports if depth == 0) / 1000
+
+    print(f"* Startup imports: {len(imports)} modules in {total_ms:.0f} ms")
+    for module, _, cumulative, depth in sorted(imports, key=lambda row: -row[2])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {'  ' * depth}{module}")
+
+    # Report each library once, by its root package.
+    eager = sorted({
+        module.split('.')[0] for module, *_ in imports
+        if module.split('.')[0] in DEFERRED_MODULES
+    })
+
+    failed = False
+    if eager:
+        print(f"! Imported at startup, but should be deferred to the runs that use them: {', '.join(eager)}")
+        failed = True
+
+    if total_ms > args.budget_ms:
+        print(f"! Startup took {total_ms:.0f} ms, over the budget of {args.budget_ms:.0f} ms")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+    print("@ Startup is within budget, and no deferred modules were imported.")
+
+
+if __name__ == '__main__':
+    main()
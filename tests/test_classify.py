@@ -0,0 +1,33 @@
+"""
+Parity check of the line classifier against golden output.
+
+`fixtures/edge_cases.rpy` collects the awkward lines of a Ren'Py script: menus and choices, `$` lines, comments,
+indented dialogue and narration, quotes inside lines, formatting tags, unmapped aliases, and mixed line endings.
+`fixtures/edge_cases.{main_character}.jsonl` is the dataset the original row-wise classifier built from it
+(`extract_text_information`, `add_filter_flags`, and `conform_speaker`, as of the baseline commit).
+A change that is meant to alter the output must also bump `base_utils.CLASSIFIER_VERSION`, so saved builds re-parse.
+
+    python -m pytest tests
+"""
+import os
+
+import pytest
+
+from adastra_analysis.adastra.util import base_utils
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCRIPT_FILE = os.path.join(FIXTURES_DIR, 'edge_cases.rpy')
+
+
+@pytest.mark.parametrize('main_character', ['Marco', 'Sam'])
+def test_classifier_matches_golden_output(main_character):
+    """
+    The dataset must serialize exactly as it did from the row-wise classifier.
+    """
+    data = base_utils.build_adastra_data_from_files([SCRIPT_FILE], main_character=main_character)
+
+    with open(os.path.join(FIXTURES_DIR, f'edge_cases.{main_character}.jsonl'), 'r') as fp:
+        expected = fp.read()
+
+    assert data.to_json(orient='records', lines=True) == expected